@@ -0,0 +1,299 @@
+#! /bin/env python3
+
+#   Throughput / latency benchmarks for the Stream blocks.
+#
+#   Each block is driven at full rate (a new word offered every clock),
+#   first with every output always ready ("sat") and then with random
+#   valid gaps and random back-pressure ("rand").
+#
+#   Reports, for each run :
+#       in/clk  : words accepted on all the inputs, per clock
+#       out/clk : words sent on all the outputs, per clock
+#       latency : clocks from the first input word to the first output word
+#       stall   : longest run of clocks an input was held off (valid & ~ready)
+#
+#   usage : bench.py [block names ...] > bench_output.txt
+
+import sys
+import random
+import collections
+
+from amaranth import *
+from amaranth.sim import *
+
+spath = "streams"
+if not spath in sys.path:
+    sys.path.append(spath)
+
+from streams.stream import Copy, Tee, Join, Split, Gate, GatePacket, Arbiter
+from streams.route import Router, MuxUp, MuxDown
+from streams.ops import Mul, Sum
+from streams.fifo import StreamFifo, PacketFifo
+
+#
+#
+
+class Result:
+
+    def __init__(self, name, load, cycles):
+        self.name = name
+        self.load = load
+        self.cycles = cycles
+        self.n_in = 0
+        self.n_out = 0
+        self.t_in = None
+        self.t_out = None
+        self.stall = 0
+        # clocks that accepted an input word, in order
+        self.accepts = []
+
+    def ii(self):
+        # the most common number of clocks between accepts
+        gaps = collections.Counter([ b - a for a, b in zip(self.accepts, self.accepts[1:]) ])
+        if not gaps:
+            return None
+        return gaps.most_common(1)[0][0]
+
+    def latency(self):
+        if self.t_out is None:
+            return None
+        return self.t_out - (self.t_in or 0)
+
+    def __str__(self):
+        lat = self.latency()
+        lat = "-" if lat is None else str(lat)
+        i = self.n_in / self.cycles
+        o = self.n_out / self.cycles
+        return f"{self.name:28s} {self.load:5s} {i:7.3f} {o:8.3f} {lat:>8s} {self.stall:6d}"
+
+header = f"{'block':28s} {'load':5s} {'in/clk':>7s} {'out/clk':>8s} {'latency':>8s} {'stall':>6s}"
+
+#
+#   Generate the words for an input Stream
+
+class Words:
+
+    def __init__(self, s, rng, psize=4, head=None):
+        self.s = s
+        self.rng = rng
+        self.psize = psize
+        # optional fn to make the first word of each packet, eg. an address
+        self.head = head
+        self.idx = 0
+
+    def next(self):
+        pos = self.idx % self.psize
+        d = {
+            "first" : pos == 0,
+            "last" : pos == (self.psize - 1),
+        }
+        for name, width in self.s.get_layout():
+            d[name] = self.rng.getrandbits(width)
+        if self.head and (pos == 0):
+            d.update(self.head(self.rng))
+        self.idx += 1
+        return d
+
+#
+#
+
+def run(dut, name, load, inputs, outputs, words, cycles=400, seed=1, setup=[]):
+    # comb-only blocks have no sync domain of their own
+    m = Module()
+    m.domains.sync = ClockDomain("sync")
+    m.submodules.dut = dut
+    sim = Simulator(m)
+    rng = random.Random(seed)
+    result = Result(name, load, cycles)
+
+    if load == "sat":
+        p_valid, p_ready = 1.0, 1.0
+    else:
+        p_valid, p_ready = 0.7, 0.6
+
+    def proc():
+        for cmd in setup:
+            yield cmd
+
+        held = [ None ] * len(inputs)
+        stall = [ 0 ] * len(inputs)
+
+        for t in range(cycles):
+            for idx, s in enumerate(inputs):
+                if (held[idx] is None) and (rng.random() < p_valid):
+                    held[idx] = words[idx].next()
+                if held[idx] is None:
+                    yield s.valid.eq(0)
+                    continue
+                d = s.cat_dict(held[idx], flags=True)
+                for cmd in s.payload_eq(d, flags=True):
+                    yield cmd
+                yield s.valid.eq(1)
+
+            for s in outputs:
+                yield s.ready.eq(rng.random() < p_ready)
+
+            for idx, s in enumerate(inputs):
+                v = yield s.valid
+                r = yield s.ready
+                if v and r:
+                    held[idx] = None
+                    result.n_in += 1
+                    if result.t_in is None:
+                        result.t_in = t
+                    if not (result.accepts and (result.accepts[-1] == t)):
+                        result.accepts.append(t)
+                    stall[idx] = 0
+                elif v:
+                    stall[idx] += 1
+                    result.stall = max(result.stall, stall[idx])
+
+            for s in outputs:
+                v = yield s.valid
+                r = yield s.ready
+                if v and r:
+                    result.n_out += 1
+                    if result.t_out is None:
+                        result.t_out = t
+
+            yield Tick()
+
+    sim.add_clock(1 / 100e6)
+    sim.add_testbench(proc)
+    sim.run()
+    return result
+
+#
+#   Benchmarks : each returns (dut, inputs, outputs, setup, Words kwargs)
+
+layout = [ ("data", 16), ]
+
+def copy(mode=None):
+    dut = Copy(layout, mode=mode)
+    return dut, [ dut.i ], [ dut.o ], [], {}
+
+def gate(mode=None, registered=True):
+    dut = Gate(layout, mode=mode, registered=registered)
+    return dut, [ dut.i ], [ dut.o ], [ dut.en.eq(1) ], {}
+
+def gate_packet(registered=True):
+    dut = GatePacket(layout, registered=registered)
+    return dut, [ dut.i ], [ dut.o ], [ dut.en.eq(1) ], {}
+
+def tee(**kwargs):
+    dut = Tee(2, layout, **kwargs)
+    return dut, [ dut.i ], dut.o, [], {}
+
+def join(mode=None):
+    dut = Join(a=[("a", 16)], b=[("b", 16)], mode=mode)
+    return dut, dut.i, [ dut.o ], [], {}
+
+def split(**kwargs):
+    dut = Split(layout=[("a", 16), ("b", 16)], **kwargs)
+    return dut, [ dut.i ], [ dut.a, dut.b ], [], {}
+
+def arbiter(**kwargs):
+    dut = Arbiter(layout=layout, n=3, **kwargs)
+    return dut, dut.i, [ dut.o ], [], {}
+
+def router():
+    addrs = [ 1, 2, 3 ]
+    dut = Router(layout=layout, addr_field="data", addrs=addrs, sink=True)
+    def head(rng):
+        return { "data" : rng.choice(addrs) }
+    return dut, [ dut.i ], list(dut.o.values()), [], { "head" : head }
+
+def mux_down():
+    dut = MuxDown(iwidth=32, owidth=8)
+    return dut, [ dut.i ], [ dut.o ], [], {}
+
+def mux_up():
+    dut = MuxUp(iwidth=8, owidth=16)
+    return dut, [ dut.i ], [ dut.o ], [], {}
+
+#   A benchmark that can't be built with the installed amaranth
+
+class Skip(Exception):
+    pass
+
+def ram_to_stream():
+    from streams.ram import RamToStream
+    try:
+        dut = RamToStream(width=16, depth=64)
+    except TypeError as ex:
+        # ram.py uses the pre-0.5 Memory(shape=...) API
+        if not "shape" in str(ex):
+            raise
+        raise Skip("ram.py needs Memory(shape=)")
+    return dut, [], [ dut.o ], [ dut.N.eq(4) ], {}
+
+def mul(**kwargs):
+    dut = Mul(16, 32, **kwargs)
+    return dut, [ dut.i ], [ dut.o ], [], {}
+
+def sum_(**kwargs):
+    dut = Sum(16, 32, **kwargs)
+    return dut, [ dut.i ], [ dut.o ], [], {}
+
+def fifo(**kwargs):
+    dut = StreamFifo(layout, 8, **kwargs)
+    return dut, [ dut.i ], [ dut.o ], [], {}
+
+def packet_fifo():
+    dut = PacketFifo(layout, 16)
+    return dut, [ dut.i ], [ dut.o ], [], {}
+
+benchmarks = [
+    ( "Copy",                   copy, {} ),
+    ( "Copy(skid)",             copy, { "mode" : "skid" } ),
+    ( "Gate",                   gate, {} ),
+    ( "Gate(skid)",             gate, { "mode" : "skid" } ),
+    ( "Gate(comb)",             gate, { "registered" : False } ),
+    ( "GatePacket",             gate_packet, {} ),
+    ( "GatePacket(comb)",       gate_packet, { "registered" : False } ),
+    ( "Tee",                    tee, {} ),
+    ( "Tee(wait_all)",          tee, { "wait_all" : True } ),
+    ( "Tee(depth=4)",           tee, { "depth" : 4 } ),
+    ( "Join",                   join, {} ),
+    ( "Join(pipe)",             join, { "mode" : "pipe" } ),
+    ( "Split",                  split, {} ),
+    ( "Split(depth=4)",         split, { "depth" : 4 } ),
+    ( "Arbiter",                arbiter, {} ),
+    ( "Arbiter(round_robin)",   arbiter, { "policy" : "round_robin" } ),
+    ( "Router",                 router, {} ),
+    ( "MuxDown",                mux_down, {} ),
+    ( "MuxUp",                  mux_up, {} ),
+    ( "RamToStream",            ram_to_stream, {} ),
+    ( "Mul",                    mul, {} ),
+    ( "Mul(pipe)",              mul, { "mode" : "pipe" } ),
+    ( "Mul(stages=3)",          mul, { "stages" : 3 } ),
+    ( "Sum",                    sum_, {} ),
+    ( "Sum(pipe)",              sum_, { "mode" : "pipe" } ),
+    ( "StreamFifo",             fifo, {} ),
+    ( "StreamFifo(bram)",       fifo, { "use_bram" : True } ),
+    ( "PacketFifo",             packet_fifo, {} ),
+]
+
+#
+#
+
+def bench(names=[], cycles=400):
+    print(header)
+    for label, fn, kwargs in benchmarks:
+        if names and not (label.split("(")[0] in names):
+            continue
+        for load in [ "sat", "rand" ]:
+            try:
+                dut, inputs, outputs, setup, extra = fn(**kwargs)
+            except Skip as ex:
+                print(f"{label:28s} skipped : {ex}")
+                break
+            rng = random.Random(1)
+            words = [ Words(s, rng, **extra) for s in inputs ]
+            r = run(dut, label, load, inputs, outputs, words, cycles=cycles, setup=setup)
+            print(r)
+
+if __name__ == "__main__":
+    bench(sys.argv[1:])
+
+#   FIN
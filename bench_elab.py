@@ -0,0 +1,97 @@
+#! /bin/env python3
+
+#   Python-side elaboration benchmarks.
+#
+#   Times, for a generated design with many streams :
+#       stream  : Stream() construction
+#       connect : Stream.connect()
+#       payload : payload_eq() and cat_payload()
+#       elab    : Fragment.get() of a chain of Copy blocks
+#       memory  : memory allocated per Stream, including its Signals
+#
+#   Reports the total time and the time per stream (or per block).
+#
+#   usage : bench_elab.py [n] > bench_elab_output.txt
+
+import sys
+import time
+import tracemalloc
+
+from amaranth import *
+from amaranth.hdl import Fragment
+
+spath = "streams"
+if not spath in sys.path:
+    sys.path.append(spath)
+
+from streams.stream import Stream, Copy, Connections
+
+layout = [ ("a", 8), ("b", 12), ("c", 16), ("d", 1), ]
+
+#
+#
+
+class Chain(Elaboratable):
+
+    def __init__(self, n):
+        self.copies = [ Copy(layout) for _ in range(n) ]
+        self.i = Stream(layout, name="i")
+        self.o = Stream(layout, name="o")
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += self.copies
+        src = self.i
+        for c in self.copies:
+            m.d.comb += Stream.connect(src, c.i)
+            src = c.o
+        m.d.comb += Stream.connect(src, self.o)
+        return m
+
+#
+#
+
+def timed(label, n, fn):
+    t = time.perf_counter()
+    fn()
+    t = time.perf_counter() - t
+    print(f"{label:10s} {n:8d} {t*1e3:10.1f}ms {t*1e6/n:8.2f}us")
+
+def bench(n):
+    print(f"{'test':10s} {'n':>8s} {'total':>12s} {'each':>10s}")
+
+    streams = []
+    def stream():
+        for i in range(n):
+            streams.append(Stream(layout, name=f"s{i}"))
+    timed("stream", n, stream)
+
+    def connect():
+        with Connections():
+            for a, b in zip(streams, streams[1:]):
+                Stream.connect(a, b, exclude=[ "d", ])
+    timed("connect", n - 1, connect)
+
+    def payload():
+        for s in streams:
+            s.payload_eq(s.cat_payload(flags=True), flags=True)
+    timed("payload", n, payload)
+
+    def elab():
+        with Connections():
+            Fragment.get(Chain(n // 10), None)
+    timed("elab", n // 10, elab)
+
+    tracemalloc.start()
+    streams = [ Stream(layout, name=f"m{i}") for i in range(n) ]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'memory':10s} {n:8d} {size/1e6:10.1f}MB {size/n:8.0f}B")
+
+if __name__ == "__main__":
+    n = 10000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    bench(n)
+
+#   FIN
@@ -1,6 +1,9 @@
 
+import os
+import warnings
+
 from amaranth import *
-from .stream import Stream
+from .stream import Stream, Connections, get_registry
 
 #
 #
@@ -23,8 +26,10 @@ class Cluster:
             return obj.name
         return obj.__class__.__name__
  
-    def __init__(self, obj):
+    def __init__(self, obj, attr=None):
         self.obj = obj
+        # attribute name in the parent object
+        self.attr = attr
         self.sub = []
         self.streams = []
 
@@ -34,6 +39,13 @@ class Cluster:
     def add_stream(self, obj):
         self.streams.append(obj)
 
+    def all_streams(self):
+        # streams in this cluster and all its sub clusters
+        streams = self.streams[:]
+        for c in self.sub:
+            streams += c.all_streams()
+        return streams
+
     def print_node(self, f, nest, node, style="filled", name=None):
         pad = " " * nest
         n = id(node)
@@ -60,7 +72,14 @@ class Cluster:
 
         print(pad, "}", file=f)
 
-    def print_connections(self, f, this):
+    def get_connections(self, connections=None):
+        # A per-design registry holds only this design's connections.
+        # The default registry holds every design's, so look them up by stream.
+        if connections is not None:
+            return list(connections)
+        return Connections.current().find(self.all_streams())
+
+    def print_connections(self, f, this, annotate=None, connections=None):
         def get_payload(s, exclude):
             if hasattr(s, "get_layout"):
                 names = []
@@ -74,9 +93,11 @@ class Cluster:
                     return ""
                 return ",".join(names)
             return "xxx"
-        for source, sink, s, exclude, fn in Stream.connections:
+        if this:
+            ids = set([ id(x) for x in self.streams ])
+        for source, sink, s, exclude, fn in self.get_connections(connections):
             if this:
-                if (source not in self.streams) or (sink not in self.streams):
+                if (id(source) not in ids) or (id(sink) not in ids):
                     continue
             p_in = get_payload(source, exclude)
             p_out = get_payload(sink, exclude)
@@ -92,55 +113,141 @@ class Cluster:
                 style = "[arrowhead=empty,penwidth=1]"
             else:
                 style = ""
+            if annotate:
+                # annotate(source, sink) -> (extra label text, extra dot attributes)
+                text, attrs = annotate(source, sink)
+                if text:
+                    payload = (payload + " " + text).strip()
+                if attrs:
+                    style += f"[{attrs}]"
             print(f' {ni} -> {no} [label="{payload}"]{style}', file=f)
 
-    def print_dot(self, f):
+    def print_dot(self, f, annotate=None, connections=None):
         print("digraph D {", file=f)
         self.print_subgraph(f=f, nest=1)
-        self.print_connections(f=f, this=None)
+        self.print_connections(f=f, this=None, annotate=annotate, connections=connections)
         print("}", file=f)
 
 #
 #
 
-def get_clusters(m, nest=1, d=None):
-    cluster = Cluster(m)
+def get_members(m):
+    # The (attr, obj) pairs to draw for block m : its registry if it has one,
+    # otherwise its attributes, then any Streams or Elaboratables held
+    # in list, tuple or dict attributes.
+    reg = get_registry(m)
+    if reg is not None:
+        if os.environ.get("STREAMS_CHECK"):
+            check_registry(m, reg)
+        return reg
+    return get_attrs(m)
+
+def check_registry(m, reg):
+    # Debug, set STREAMS_CHECK in the environment : warn about any Stream
+    # attributes a registering block left out, as dot won't draw them.
+    known = set([ id(obj) for _, obj in reg ])
+    missed = [ name for name, a in get_attrs(m) if isinstance(a, Stream) and not id(a) in known ]
+    if missed:
+        warnings.warn(f"{m.__class__.__name__} : unregistered Streams {missed}")
+    return missed
+
+def get_attrs(m):
+    members = []
+    held = []
+    for name, a in getattr(m, "__dict__", {}).items():
+        if name == "next":
+            continue
+        if isinstance(a, (list, tuple)):
+            held += [ (f"{name}[{i}]", x) for i, x in enumerate(a) if isinstance(x, (Stream, Elaboratable)) ]
+        elif isinstance(a, dict):
+            held += [ (f"{name}[{k}]", x) for k, x in a.items() if isinstance(x, (Stream, Elaboratable)) ]
+        else:
+            members.append((name, a))
+    return members + held
+
+def get_clusters(m, nest=1, d=None, attr=None):
+    cluster = Cluster(m, attr)
     if hasattr(m, "dot_dont_expand"):
         return cluster
 
     names = d or {}
     names[id(m)] = True
 
-    for name in dir(m):
-        if name == "next":
-            continue
-        a = getattr(m, name)
+    streams = {}
+    for name, a in get_members(m):
         if id(a) in names:
             continue
         if isinstance(a, Elaboratable):
-            c = get_clusters(a, nest + 1, names)
+            c = get_clusters(a, nest + 1, names, attr=name)
             cluster.add(c)
-        if isinstance(a, Stream):
+        if isinstance(a, Stream) and not id(a) in streams:
+            streams[id(a)] = True
             cluster.add_stream(a)
 
     return cluster
 
+def cluster_name(c):
+    return getattr(c.obj, "name", None) or c.obj.__class__.__name__
+
+#
+#   The blocks, Streams and connections of an elaborated design,
+#   with a dotted path for each. Shared by profiler.Profiler and
+#   export.Graph, so the two views see the same graph.
+
+class Design:
+
+    def __init__(self, m, connections=None):
+        # (obj, path, index of the parent block or None)
+        self.blocks = []
+        # (stream, path, index of the owning block)
+        self.streams = []
+        # id(stream) -> index into self.streams
+        self.index = {}
+
+        def walk(cluster, path, parent):
+            b = len(self.blocks)
+            self.blocks.append((cluster.obj, path, parent))
+            for s in cluster.streams:
+                self.index[id(s)] = len(self.streams)
+                self.streams.append((s, path + "." + str(s.name), b))
+            for c in cluster.sub:
+                walk(c, path + "." + str(c.attr), b)
+
+        self.top = get_clusters(m)
+        walk(self.top, cluster_name(self.top), None)
+
+        # (source, sink, exclude) for every connection to or from the
+        # design's streams, once per source / sink pair
+        if connections is None:
+            connections = Connections.current()
+        self.edges = []
+        seen = set()
+        for source, sink, _, exclude, _ in connections.find([ s for s, _, _ in self.streams ]):
+            key = (id(source), id(sink))
+            if key in seen:
+                continue
+            seen.add(key)
+            self.edges.append((source, sink, exclude))
+
 def run(dot, png):
     import subprocess, os
     _, fmt = os.path.splitext(png)
     fmt = fmt[1:] # strip leading '.'
-    cmd = f"dot -T {fmt} {dot} -o {png}"
-    print("run", cmd)
-    x = subprocess.call(cmd, shell=True)
+    cmd = [ "dot", "-T", fmt, dot, "-o", png ]
+    print("run", " ".join(cmd))
+    try:
+        x = subprocess.call(cmd)
+    except FileNotFoundError:
+        x = -1
     if x == 0:
         print("generated", png)
     else:
         print("error generating", png)
 
-def graph(m, d_path, p_path):
+def graph(m, d_path, p_path, annotate=None, connections=None):
     f = open(d_path, "w")
     c = get_clusters(m)
-    c.print_dot(f)
+    c.print_dot(f, annotate=annotate, connections=connections)
     f.close()
     run(d_path, p_path)
 
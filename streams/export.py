@@ -0,0 +1,289 @@
+
+import sys
+import json
+import xml.etree.ElementTree as ET
+
+from amaranth import *
+
+from streams.dot import Design
+
+__all__ = [ "Graph", "get_timing", ]
+
+#
+#   Structured export of the Stream graph, as JSON or GraphML,
+#   and a static throughput pass.
+#
+#   Blocks declare their timing with two attributes :
+#       latency : clocks from an input word to the matching output word
+#       ii : initiation interval, the fewest clocks between input words
+#   eg. a legacy Copy takes a word every 3 clocks, Copy(mode="skid") every clock.
+#   Undeclared blocks are taken as latency 0, ii 1 (ie. never the bottleneck),
+#   and are listed as 'undeclared' on the paths that pass through them.
+#
+#   Create the Graph after the design has been elaborated :
+#
+#       with Connections() as c:
+#           sim = Simulator(dut)
+#       g = Graph(dut, connections=c)
+#       g.write_json("x.json")
+#       g.print_throughput()
+
+def get_timing(obj):
+    # (latency, ii), either may be None
+    return getattr(obj, "latency", None), getattr(obj, "ii", None)
+
+def get_width(width):
+    return Shape.cast(width).width
+
+class Graph:
+
+    def __init__(self, m, connections=None):
+        d = Design(m, connections=connections)
+        self.index = d.index
+
+        self.blocks = []
+        # block index -> set of ancestor block indices
+        self.ancestors = []
+        for b, (obj, path, parent) in enumerate(d.blocks):
+            latency, ii = get_timing(obj)
+            self.blocks.append({
+                "id" : f"b{b}",
+                "path" : path,
+                "class" : obj.__class__.__name__,
+                "parent" : None if parent is None else f"b{parent}",
+                "latency" : latency,
+                "ii" : ii,
+            })
+            up = set() if parent is None else self.ancestors[parent] | { parent }
+            self.ancestors.append(up)
+
+        self.streams = []
+        for n, (s, path, b) in enumerate(d.streams):
+            self.streams.append({
+                "id" : f"s{n}",
+                "path" : path,
+                "name" : str(s.name),
+                "block" : b,
+                "width" : get_width(s.layout.width),
+                "layout" : [ [ name, get_width(w) ] for name, w in s.fields() ],
+            })
+
+        # only the connections within the design
+        self.edges = []
+        for source, sink, exclude in d.edges:
+            a, b = self.index.get(id(source)), self.index.get(id(sink))
+            if (a is None) or (b is None):
+                continue
+            fields = [ name for name, _ in source.fields() if not name in (exclude or []) ]
+            self.edges.append((a, b, fields))
+
+        self.make_flow()
+
+    def inside(self, s, b):
+        # stream s is owned by block b, or one of its sub-blocks
+        owner = self.streams[s]["block"]
+        return (owner == b) or (b in self.ancestors[owner])
+
+    def make_flow(self):
+        # Data flows along the connections, and through each block's own
+        # logic : from its inputs (streams that receive from outside the
+        # block and go nowhere) to its outputs (streams that send outside
+        # the block and are fed by nothing). Unconnected streams are taken
+        # as outputs of a block that has connected inputs.
+        n = len(self.streams)
+        self.succ = [ [] for _ in range(n) ]
+        pred = [ [] for _ in range(n) ]
+        for a, b, _ in self.edges:
+            self.succ[a].append((b, None))
+            pred[b].append(a)
+
+        owned = [ [] for _ in self.blocks ]
+        for s, d in enumerate(self.streams):
+            owned[d["block"]].append(s)
+
+        for b, streams in enumerate(owned):
+            ins, outs, loose = [], [], []
+            for s in streams:
+                if not (self.succ[s] or pred[s]):
+                    loose.append(s)
+                elif not self.succ[s]:
+                    if not [ x for x in pred[s] if self.inside(x, b) ]:
+                        ins.append(s)
+                elif not pred[s]:
+                    if not [ x for x, _ in self.succ[s] if self.inside(x, b) ]:
+                        outs.append(s)
+            if ins:
+                outs += loose
+            for i in ins:
+                for o in outs:
+                    # through block b
+                    self.succ[i].append((o, b))
+                    pred[o].append(i)
+
+        self.sources = [ s for s in range(n) if self.succ[s] and not pred[s] ]
+
+    def order(self):
+        # the streams reachable from the sources, in topological order
+        # (reverse post-order of a depth first walk). Feedback edges, back
+        # to a stream still being walked, are left out.
+        n = len(self.streams)
+        state = [ 0 ] * n # 0 unseen, 1 being walked, 2 done
+        post = []
+        forward = [ [] for _ in range(n) ]
+        for src in self.sources:
+            if state[src]:
+                continue
+            state[src] = 1
+            stack = [ (src, iter(self.succ[src])) ]
+            while stack:
+                s, it = stack[-1]
+                for x, b in it:
+                    if state[x] == 1:
+                        continue
+                    forward[s].append((x, b))
+                    if state[x] == 0:
+                        state[x] = 1
+                        stack.append((x, iter(self.succ[x])))
+                        break
+                else:
+                    stack.pop()
+                    state[s] = 2
+                    post.append(s)
+        return post[::-1], forward
+
+    def throughput(self):
+        # Steady-state bound of the worst path to each sink, in words per
+        # clock : 1 / (the largest ii of any block on the path).
+        # One pass in topological order keeps, for each stream, the worst
+        # ii, the block that sets it, the latency and a back-pointer.
+        # Latency sums the innermost declared blocks the path enters, so eg.
+        # a Copy and the SkidBuffer inside it aren't both counted.
+        # Slowest paths first.
+        def get_ii(b):
+            ii = self.blocks[b]["ii"]
+            return 1 if ii is None else ii
+
+        # the latency of each block, unless a sub-block declares one
+        own = [ d["latency"] or 0 for d in self.blocks ]
+        for b, d in enumerate(self.blocks):
+            if d["latency"] is not None:
+                for x in self.ancestors[b]:
+                    own[x] = 0
+
+        def entered(a, b):
+            # latency of the blocks entered going from stream a to stream b
+            oa, ob = self.streams[a]["block"], self.streams[b]["block"]
+            outside = self.ancestors[oa] | { oa }
+            return sum([ own[x] for x in self.ancestors[ob] | { ob } if not x in outside ])
+
+        order, forward = self.order()
+        # stream -> [ ii, limit block, latency, (previous stream, through block) ]
+        best = {}
+        for s in self.sources:
+            b = self.streams[s]["block"]
+            best[s] = [ get_ii(b), b, 0, None ]
+        for s in order:
+            ii, limit, latency, _ = best[s]
+            for x, through in forward[s]:
+                cand = [ ii, limit, latency, (s, through) ]
+                for b in [ self.streams[x]["block"], through ]:
+                    if (b is not None) and (get_ii(b) > cand[0]):
+                        cand[0], cand[1] = get_ii(b), b
+                cand[2] += entered(s, x)
+                old = best.get(x)
+                if (old is None) or ((cand[0], cand[2]) > (old[0], old[2])):
+                    best[x] = cand
+
+        r = []
+        for s in order:
+            if forward[s]:
+                continue
+            ii, limit, latency, back = best[s]
+            path, undeclared = [ s ], []
+            while back is not None:
+                prev, through = back
+                if (through is not None) and (self.blocks[through]["ii"] is None):
+                    undeclared.append(self.blocks[through]["path"])
+                path.append(prev)
+                back = best[prev][3]
+            r.append({
+                "path" : [ self.streams[x]["path"] for x in path[::-1] ],
+                "rate" : 1 / ii,
+                "latency" : latency,
+                "limit" : None if ii == 1 else self.blocks[limit]["path"],
+                "undeclared" : undeclared[::-1],
+            })
+        return sorted(r, key=lambda x: x["rate"])
+
+    def bottleneck(self):
+        # the block limiting the slowest path
+        r = self.throughput()
+        if not r:
+            return None
+        return r[0]["limit"]
+
+    def to_dict(self):
+        return {
+            "blocks" : self.blocks,
+            "streams" : [ dict(d, block=f"b{d['block']}") for d in self.streams ],
+            "connections" : [ { "source" : f"s{a}", "sink" : f"s{b}", "fields" : f } for a, b, f in self.edges ],
+            "throughput" : self.throughput(),
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def write_graphml(self, path):
+        # blocks and streams are nodes, 'kind' tells them apart.
+        # Edges are the connections, plus 'owns' edges from block to stream.
+        ns = "http://graphml.graphdrawing.org/xmlns"
+        root = ET.Element("graphml", xmlns=ns)
+        keys = [
+            ("kind", "node", "string"),
+            ("path", "node", "string"),
+            ("class", "node", "string"),
+            ("latency", "node", "int"),
+            ("ii", "node", "int"),
+            ("width", "node", "int"),
+            ("kind", "edge", "string"),
+            ("fields", "edge", "string"),
+        ]
+        for name, where, t in keys:
+            ET.SubElement(root, "key", { "id" : f"{where}_{name}", "for" : where, "attr.name" : name, "attr.type" : t })
+        g = ET.SubElement(root, "graph", id="G", edgedefault="directed")
+
+        def data(e, where, name, value):
+            if value is not None:
+                x = ET.SubElement(e, "data", key=f"{where}_{name}")
+                x.text = str(value)
+
+        for d in self.blocks:
+            e = ET.SubElement(g, "node", id=d["id"])
+            data(e, "node", "kind", "block")
+            for name in [ "path", "class", "latency", "ii" ]:
+                data(e, "node", name, d[name])
+        for d in self.streams:
+            e = ET.SubElement(g, "node", id=d["id"])
+            data(e, "node", "kind", "stream")
+            data(e, "node", "path", d["path"])
+            data(e, "node", "width", d["width"])
+            e = ET.SubElement(g, "edge", source=f"b{d['block']}", target=d["id"])
+            data(e, "edge", "kind", "owns")
+        for a, b, fields in self.edges:
+            e = ET.SubElement(g, "edge", source=f"s{a}", target=f"s{b}")
+            data(e, "edge", "kind", "connect")
+            data(e, "edge", "fields", ",".join(fields))
+
+        ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+
+    def print_throughput(self, f=sys.stdout):
+        print(f"{'words/clk':>9s} {'latency':>7s} {'limit':30s} path", file=f)
+        for d in self.throughput():
+            ends = d["path"][0] + " -> " + d["path"][-1]
+            print(f"{d['rate']:9.3f} {d['latency']:7d} {str(d['limit']):30s} {ends}", file=f)
+            if d["undeclared"]:
+                print(f"{'':18s}undeclared : {' '.join(d['undeclared'])}", file=f)
+        print("bottleneck :", self.bottleneck(), file=f)
+
+#   FIN
@@ -0,0 +1,252 @@
+
+from amaranth import *
+from amaranth.lib.fifo import SyncFIFO, SyncFIFOBuffered, AsyncFIFO, AsyncFIFOBuffered
+from amaranth.lib.memory import Memory
+
+from streams.stream import Stream, register
+
+__all__ = [ "StreamFifo", "AsyncStreamFifo", "PacketFifo", ]
+
+#
+#
+
+def payload_width(s):
+    # including first / last
+    return s.layout.width + 2
+
+#
+#   Buffer a Stream, including the first/last flags.
+#
+#   Takes one word per clock on the input and sends one word per clock
+#   on the output, so bursts are absorbed rather than stalling the source.
+#
+#   use_bram=False : SyncFIFO, asynchronous read (distributed / LUT RAM)
+#   use_bram=True : SyncFIFOBuffered, registered read (block RAM)
+
+class StreamFifo(Elaboratable):
+
+    def __init__(self, layout, depth, use_bram=False, af_level=None, ae_level=None, name="StreamFifo"):
+        self.name = name
+        self.depth = depth
+        self.i = Stream(layout=layout, name="i", owner=self)
+        self.o = Stream(layout=layout, name="o", owner=self)
+
+        width = payload_width(self.i)
+        if use_bram:
+            cls = SyncFIFOBuffered
+        else:
+            cls = SyncFIFO
+        self.fifo = register(self, cls(width=width, depth=depth), "fifo")
+        self.latency, self.ii = (2 if use_bram else 1), 1
+
+        # number of words held
+        self.level = Signal(range(depth+1))
+        # level >= af_level
+        self.almost_full = Signal()
+        self.af_level = depth - 1 if af_level is None else af_level
+        # level <= ae_level
+        self.almost_empty = Signal()
+        self.ae_level = 1 if ae_level is None else ae_level
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.fifo = fifo = self.fifo
+
+        m.d.comb += [
+            # write side
+            fifo.w_data.eq(self.i.cat_payload(flags=True)),
+            fifo.w_en.eq(self.i.valid),
+            self.i.ready.eq(fifo.w_rdy),
+            # read side
+            self.o.valid.eq(fifo.r_rdy),
+            fifo.r_en.eq(self.o.ready),
+        ]
+        m.d.comb += self.o.payload_eq(fifo.r_data, flags=True)
+
+        m.d.comb += [
+            self.level.eq(fifo.level),
+            self.almost_full.eq(fifo.level >= self.af_level),
+            self.almost_empty.eq(fifo.level <= self.ae_level),
+        ]
+
+        return m
+
+    def ports(self): return []
+
+#
+#   Clock domain crossing Stream buffer.
+#
+#   The input Stream 'i' is in w_domain, the output Stream 'o' in r_domain.
+#   Uses gray coded pointers (amaranth.lib.fifo.AsyncFIFO), so each side
+#   runs at one word per clock of its own domain.
+#   depth must be a power of 2.
+
+class AsyncStreamFifo(Elaboratable):
+
+    def __init__(self, layout, depth, r_domain="sync", w_domain="sync", use_bram=False, name="AsyncStreamFifo"):
+        self.name = name
+        self.depth = depth
+        self.i = Stream(layout=layout, name="i", owner=self)
+        self.o = Stream(layout=layout, name="o", owner=self)
+
+        width = payload_width(self.i)
+        if use_bram:
+            cls = AsyncFIFOBuffered
+        else:
+            cls = AsyncFIFO
+        fifo = cls(width=width, depth=depth, r_domain=r_domain, w_domain=w_domain)
+        self.fifo = register(self, fifo, "fifo")
+        # latency depends on the clocks
+        self.latency, self.ii = None, 1
+
+        # number of words held, as seen from each domain
+        self.w_level = Signal(range(depth+1))
+        self.r_level = Signal(range(depth+1))
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.fifo = fifo = self.fifo
+
+        m.d.comb += [
+            # write side (w_domain)
+            fifo.w_data.eq(self.i.cat_payload(flags=True)),
+            fifo.w_en.eq(self.i.valid),
+            self.i.ready.eq(fifo.w_rdy),
+            self.w_level.eq(fifo.w_level),
+            # read side (r_domain)
+            self.o.valid.eq(fifo.r_rdy),
+            fifo.r_en.eq(self.o.ready),
+            self.r_level.eq(fifo.r_level),
+        ]
+        m.d.comb += self.o.payload_eq(fifo.r_data, flags=True)
+
+        return m
+
+    def ports(self): return []
+
+#
+#   Store and forward packet buffer.
+#
+#   Packets (delimited by first/last) are written into RAM and only
+#   become visible on the output once the 'last' word has been written,
+#   so the output sends each packet as a burst at one word per clock.
+#
+#   The packet being written is discarded if :
+#       'abort' is asserted (with any word of the packet, or on its own),
+#       a 'first' arrives before the 'last' of the previous packet,
+#       the packet fills the buffer, so can never complete.
+#   The rest of a discarded packet, up to its 'last', is dropped.
+#   'dropped' pulses for each discarded packet.
+#
+#   depth must be a power of 2.
+
+class PacketFifo(Elaboratable):
+
+    def __init__(self, layout, depth, name="PacketFifo"):
+        assert depth and not (depth & (depth - 1)), ("depth must be a power of 2", depth)
+        self.name = name
+        self.depth = depth
+        self.i = Stream(layout=layout, name="i", owner=self)
+        self.o = Stream(layout=layout, name="o", owner=self)
+
+        self.abort = Signal()
+        self.dropped = Signal()
+        # a packet is only sent once its last word is in, so latency depends on its length
+        self.latency, self.ii = None, 1
+
+        width = payload_width(self.i)
+        self.mem = register(self, Memory(shape=unsigned(width), depth=depth, init=[]), "mem")
+
+        # pointers have an extra bit to tell full from empty
+        self.abits = (depth - 1).bit_length()
+        self.wr = Signal(self.abits + 1)
+        self.committed = Signal(self.abits + 1)
+        self.rd = Signal(self.abits + 1)
+        self.dropping = Signal()
+
+        # number of words in complete packets
+        self.level = Signal(range(depth+1))
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.mem = self.mem
+
+        wp = self.mem.write_port()
+        rp = self.mem.read_port(transparent_for=[ wp ])
+
+        abits = self.abits
+
+        full = Signal()
+        m.d.comb += full.eq((self.wr[abits] != self.rd[abits]) & (self.wr[:abits] == self.rd[:abits]))
+
+        # Write side
+
+        write = Signal()
+        m.d.comb += write.eq(self.i.first | ~self.dropping)
+
+        # words being dropped are accepted even when full
+        m.d.comb += self.i.ready.eq(Mux(write, ~full, 1))
+
+        # a 'first' restarts the packet at the committed pointer
+        addr = Signal.like(self.wr)
+        m.d.comb += addr.eq(Mux(self.i.first, self.committed, self.wr))
+
+        m.d.comb += [
+            wp.addr.eq(addr[:abits]),
+            wp.data.eq(self.i.cat_payload(flags=True)),
+        ]
+
+        m.d.sync += self.dropped.eq(0)
+
+        # buffer is full of an incomplete packet
+        stuck = Signal()
+        m.d.comb += stuck.eq(full & (self.rd == self.committed))
+
+        with m.If(self.i.valid & self.i.ready):
+            with m.If(write):
+                m.d.comb += wp.en.eq(1)
+                m.d.sync += [
+                    self.wr.eq(addr + 1),
+                    self.dropping.eq(0),
+                ]
+                with m.If(self.i.first & (self.wr != self.committed)):
+                    # incomplete packet overwritten
+                    m.d.sync += self.dropped.eq(1)
+                with m.If(self.abort):
+                    m.d.sync += [
+                        self.wr.eq(self.committed),
+                        self.dropping.eq(~self.i.last),
+                        self.dropped.eq(1),
+                    ]
+                with m.Elif(self.i.last):
+                    m.d.sync += self.committed.eq(addr + 1)
+            with m.Elif(self.i.last):
+                m.d.sync += self.dropping.eq(0)
+
+        with m.Elif(self.abort | stuck):
+            with m.If(self.wr != self.committed):
+                m.d.sync += [
+                    self.wr.eq(self.committed),
+                    self.dropping.eq(1),
+                    self.dropped.eq(1),
+                ]
+
+        # Read side : the read port is addressed with the next read pointer,
+        # so the data for o is available on every clock.
+
+        rd_next = Signal.like(self.rd)
+        m.d.comb += rd_next.eq(self.rd + (self.o.valid & self.o.ready))
+        m.d.sync += self.rd.eq(rd_next)
+
+        m.d.comb += [
+            rp.addr.eq(rd_next[:abits]),
+            self.o.valid.eq(self.rd != self.committed),
+            self.level.eq(self.committed - self.rd),
+        ]
+        m.d.comb += self.o.payload_eq(rp.data, flags=True)
+
+        return m
+
+    def ports(self): return []
+
+#   FIN
@@ -0,0 +1,137 @@
+
+import numpy as np
+
+__all__ = [
+    "flatten", "to_lists",
+    "sum_packets", "sum_signed_packets", "max_values", "abs_values", "delta",
+    "decimate", "enumerate_packets", "bit_state", "mux_up", "mux_down", "packetise",
+]
+
+#
+#   Golden models of the Stream blocks, for checking sim output.
+#
+#   Packets are lists of lists (or arrays) of ints; results are
+#   numpy int64 arrays, masked to the output width as the hardware does.
+#   Widths must be < 63 bits.
+
+def mask(x, width):
+    return np.asarray(x, dtype=np.int64) & ((1 << width) - 1)
+
+def as_signed(x, width):
+    x = mask(x, width)
+    sign = 1 << (width - 1)
+    return (x ^ sign) - sign
+
+def flatten(packets):
+    # -> (all the words, start index of each packet, length of each packet)
+    lens = np.array([ len(p) for p in packets ], dtype=np.int64)
+    starts = np.zeros(len(lens), dtype=np.int64)
+    starts[1:] = np.cumsum(lens)[:-1]
+    if not len(lens) or not lens.sum():
+        return np.zeros(0, dtype=np.int64), starts, lens
+    flat = np.concatenate([ np.asarray(p, dtype=np.int64) for p in packets if len(p) ])
+    return flat, starts, lens
+
+def unflatten(flat, lens):
+    return np.split(flat, np.cumsum(lens)[:-1])
+
+def to_lists(packets):
+    # for comparing with SinkSim.get_data()
+    return [ [ int(x) for x in p ] for p in packets ]
+
+def index_in_packet(starts, lens):
+    # position of each word within its packet
+    n = int(lens.sum())
+    return np.arange(n, dtype=np.int64) - np.repeat(starts, lens)
+
+#
+#   ops.py
+
+def _sum(x, starts, lens, owidth):
+    keep = lens > 0
+    s = np.add.reduceat(x, starts[keep]) if len(x) else np.zeros(0, dtype=np.int64)
+    return mask(s, owidth)
+
+def sum_packets(packets, iwidth, owidth):
+    # Sum : one output per packet
+    flat, starts, lens = flatten(packets)
+    return _sum(mask(flat, iwidth), starts, lens, owidth)
+
+def sum_signed_packets(packets, iwidth, owidth):
+    # SumSigned : one output per packet
+    flat, starts, lens = flatten(packets)
+    return _sum(as_signed(flat, iwidth), starts, lens, owidth)
+
+def max_values(a, b, iwidth, owidth):
+    # Max : signed compare of the 'a' and 'b' fields
+    return mask(np.maximum(as_signed(a, iwidth), as_signed(b, iwidth)), owidth)
+
+def abs_values(data, width):
+    # Abs
+    return mask(np.abs(as_signed(data, width)), width)
+
+def delta(packets, width):
+    # Delta : only the words that differ from the previous word.
+    # The packet structure is lost, so returns a flat array.
+    flat, _, _ = flatten(packets)
+    x = mask(flat, width)
+    prev = np.concatenate([ [ 0 ], x[:-1] ]).astype(np.int64)
+    return x[x != prev]
+
+def decimate(data, n):
+    # Decimate : every Nth word of a flat sequence (the count runs across packets)
+    return np.asarray(data, dtype=np.int64)[::n]
+
+def enumerate_packets(packets, offset=0, width=8, step=1):
+    # Enumerate : the 'idx' field for each word, restarting in each packet
+    flat, starts, lens = flatten(packets)
+    idx = mask((index_in_packet(starts, lens) * step) + offset, width)
+    return unflatten(idx, lens)
+
+def num_bits(n):
+    return max(1, (n - 1).bit_length())
+
+def bit_state(data, width):
+    # BitState : each word becomes a packet of (bit index, bit state),
+    # for bits 0 .. num_bits(width)-1. Returns 2 arrays of shape (words, bits)
+    nbits = num_bits(width)
+    x = mask(data, width)
+    bits = np.arange(nbits, dtype=np.int64)
+    state = (x[:, None] >> bits[None, :]) & 1
+    return np.broadcast_to(bits, state.shape), state
+
+#
+#   route.py
+
+def mux_down(packets, iwidth, owidth):
+    # MuxDown : each wide word is split into narrow words, low bits first
+    flat, _, lens = flatten(packets)
+    n = (iwidth + (owidth - 1)) // owidth
+    shifts = np.arange(n, dtype=np.int64) * owidth
+    words = mask(mask(flat, iwidth)[:, None] >> shifts[None, :], owidth)
+    return unflatten(words.reshape(-1), lens * n)
+
+def mux_up(packets, iwidth, owidth):
+    # MuxUp : owidth // iwidth narrow words are packed into each wide word,
+    # the first word in the high bits. A short group at the end of a packet
+    # is packed into the low bits.
+    flat, starts, lens = flatten(packets)
+    n = owidth // iwidth
+    pos = index_in_packet(starts, lens)
+    # group number within the packet, and its length
+    group = pos // n
+    glen = np.minimum(n, np.repeat(lens, lens) - (group * n))
+    shift = (glen - 1 - (pos % n)) * iwidth
+    x = mask(flat, iwidth) << shift
+    # a group starts on each word with (pos % n) == 0
+    gstarts = np.flatnonzero((pos % n) == 0)
+    words = mask(np.add.reduceat(x, gstarts), owidth) if len(x) else x
+    ngroups = (lens + (n - 1)) // n
+    return unflatten(words, ngroups)
+
+def packetise(data, psize):
+    # Packetiser : chop a flat sequence into packets of psize words
+    x = np.asarray(data, dtype=np.int64)
+    return np.split(x, np.arange(psize, len(x), psize))
+
+#   FIN
@@ -237,6 +237,104 @@ class UartMonitor(Elaboratable):
 
         return m
 
+#
+#   Performance counters for a Stream.
+#
+#   Attach to any Stream with tap(), it only reads the handshake and flags.
+#   Counts :
+#       cycles : clocks since the last clear
+#       transfers : valid & ready
+#       stalls : valid & ~ready (back-pressure)
+#       starved : ready & ~valid (waiting for data)
+#       packets : transfers with 'last'
+#
+#   Any word on the control Stream 'ci' sends a snapshot of the counters
+#   as a single word on 'o'; with ci.clear set the counters are then cleared.
+#   If period is set, a snapshot is also sent every 'period' clocks,
+#   eg. to feed a UartMonitor (which taps 'o', so hold o.ready hi).
+
+class StreamCounters(Elaboratable):
+
+    fields = [ "cycles", "transfers", "stalls", "starved", "packets", ]
+
+    def __init__(self, layout=[], width=32, period=None, name="StreamCounters"):
+        self.name = name
+        self.period = period
+        self.i = Stream(layout=layout, name="i")
+        self.ci = Stream(layout=[("clear", 1),], name="ci")
+        self.o = Stream(layout=[ (f, width) for f in self.fields ], name="o")
+        self.clr = Signal()
+
+        for f in self.fields:
+            setattr(self, f, Signal(width, name=f))
+        if period:
+            self.timer = Signal(range(period))
+
+    def tap(self, s):
+        # passive connection : copy the handshake, don't drive s.ready
+        connect = [
+            self.i.valid.eq(s.valid),
+            self.i.ready.eq(s.ready),
+            self.i.first.eq(s.first),
+            self.i.last.eq(s.last),
+        ]
+        connect += draw(s, self.i)
+        return connect
+
+    def elaborate(self, platform):
+        m = Module()
+
+        i = self.i
+
+        m.d.sync += self.cycles.eq(self.cycles + 1)
+        with m.If(i.valid & i.ready):
+            m.d.sync += self.transfers.eq(self.transfers + 1)
+            with m.If(i.last):
+                m.d.sync += self.packets.eq(self.packets + 1)
+        with m.If(i.valid & ~i.ready):
+            m.d.sync += self.stalls.eq(self.stalls + 1)
+        with m.If(i.ready & ~i.valid):
+            m.d.sync += self.starved.eq(self.starved + 1)
+
+        # Read out
+
+        with m.If(self.o.valid & self.o.ready):
+            m.d.sync += self.o.valid.eq(0)
+
+        m.d.comb += self.ci.ready.eq(~self.o.valid)
+
+        snapshot = Signal()
+        clear = Signal()
+        m.d.comb += clear.eq(self.clr)
+
+        with m.If(self.ci.valid & self.ci.ready):
+            m.d.comb += [
+                snapshot.eq(1),
+                clear.eq(self.clr | self.ci.clear),
+            ]
+
+        if self.period:
+            m.d.sync += self.timer.eq(self.timer + 1)
+            with m.If(self.timer == (self.period - 1)):
+                m.d.sync += self.timer.eq(0)
+                with m.If(~self.o.valid):
+                    m.d.comb += snapshot.eq(1)
+
+        with m.If(snapshot):
+            m.d.sync += [
+                self.o.valid.eq(1),
+                self.o.first.eq(1),
+                self.o.last.eq(1),
+            ]
+            for f in self.fields:
+                m.d.sync += getattr(self.o, f).eq(getattr(self, f))
+
+        with m.If(clear):
+            for f in self.fields:
+                m.d.sync += getattr(self, f).eq(0)
+
+        return m
+
 #
 #
 
@@ -246,12 +344,12 @@ class Monitor(Elaboratable):
         self.i = []
         for i in range(n):
             name = f"i{i}"
-            s = Stream(layout=layout, name=name)
+            s = Stream(layout=layout, name=name, owner=self)
             setattr(self, name, s)
             self.i.append(s)
-        self.o0 = Stream(layout=layout, name="o0")
-        self.o1 = Stream(layout=layout, name="o1")
-        self.ci = Stream(layout=[("data", 32),], name="ci")
+        self.o0 = Stream(layout=layout, name="o0", owner=self)
+        self.o1 = Stream(layout=layout, name="o1", owner=self)
+        self.ci = Stream(layout=[("data", 32),], name="ci", owner=self)
 
         self.sel0 = Signal(range(n))
         self.sel1 = Signal(range(n))
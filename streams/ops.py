@@ -41,32 +41,59 @@ assert num_bits(7) == 3
 assert num_bits(8) == 3
 assert num_bits(9) == 4
 
+#   Register stage handshake.
+#
+#   mode=None : i.ready is registered, cleared on each transfer
+#               and only set again once o.valid has been read.
+#               One transfer every third clock.
+#   mode="pipe" : i.ready is o.ready | ~o.valid (combinatorial),
+#               the payload is registered. One transfer per clock.
+
+modes = [ None, "pipe" ]
+
+def stage_timing(mode):
+    # (latency, ii) for export.Graph, as measured by bench.py
+    return (1, 1) if mode == "pipe" else (1, 3)
+
+def stage_ready(m, i, o, mode):
+    # call after any o.valid assignments : the output register is read
+    if mode == "pipe":
+        m.d.comb += i.ready.eq(o.ready | ~o.valid)
+    else:
+        with m.If((~i.ready) & ~o.valid):
+            m.d.sync += i.ready.eq(1)
+
+def stage_accept(m, i, mode):
+    # call when the input is accepted
+    if mode != "pipe":
+        m.d.sync += i.ready.eq(0)
+
 #
 #
 
 class BinaryOp(Elaboratable):
 
-    def __init__(self, iwidth, owidth, name=None):
-        self.i = Stream(layout=[ ("a", iwidth), ("b", iwidth), ], name=add_name(name, "in"))
-        self.o = Stream(layout=[ ("data", owidth), ], name=add_name(name, "out"))
+    def __init__(self, iwidth, owidth, name=None, mode=None):
+        assert mode in modes, ("unknown mode", mode)
+        self.mode = mode
+        self.latency, self.ii = stage_timing(mode)
+        self.i = Stream(layout=[ ("a", iwidth), ("b", iwidth), ], name=add_name(name, "in"), owner=self)
+        self.o = Stream(layout=[ ("data", owidth), ], name=add_name(name, "out"), owner=self)
 
     def elaborate(self, platform):
         m = Module()
 
+        with m.If(self.o.valid & self.o.ready):
+            m.d.sync += self.o.valid.eq(0)
+
         with m.If(self.i.valid & self.i.ready):
             exclude = [ "valid", "ready", "a", "b" ]
             m.d.sync += Stream.connect(self.i, self.o, exclude=exclude)
             m.d.sync += self.op(m, self.i.a, self.i.b)
-            m.d.sync += [
-                self.i.ready.eq(0),
-                self.o.valid.eq(1),
-            ]
-
-        with m.If(self.o.valid & self.o.ready):
-            m.d.sync += self.o.valid.eq(0)
+            m.d.sync += self.o.valid.eq(1)
+            stage_accept(m, self.i, self.mode)
 
-        with m.If((~self.i.ready) & ~self.o.valid):
-            m.d.sync += self.i.ready.eq(1)
+        stage_ready(m, self.i, self.o, self.mode)
 
         return m
 
@@ -75,11 +102,97 @@ class BinaryOp(Elaboratable):
 #
 #
 
+#   Mul(iwidth, owidth, stages=N) splits 'b' into N slices and
+#   accumulates the partial products a * b[slice] over N register stages.
+#   Each partial product is iwidth * (iwidth/N) bits, small enough to
+#   map onto a DSP block. The stages advance together whenever the output
+#   register is free, so it takes one word per clock with N clocks latency.
+
 class Mul(BinaryOp):
 
+    is_signed = False
+
+    def __init__(self, iwidth, owidth, name=None, mode=None, stages=1):
+        BinaryOp.__init__(self, iwidth, owidth, name=name, mode=mode)
+        assert 1 <= stages <= iwidth, ("bad number of stages", stages)
+        self.stages = stages
+        # [lo, hi) bit ranges of 'b' for each stage, the top slice takes any remainder
+        w = iwidth // stages
+        self.slices = [ (k * w, (k + 1) * w) for k in range(stages) ]
+        self.slices[-1] = (self.slices[-1][0], iwidth)
+        if stages > 1:
+            self.latency, self.ii = stages, 1
+
     def op(self, m, a, b):
         return [ self.o.data.eq(a * b), ]
 
+    def elaborate(self, platform):
+        if self.stages == 1:
+            return BinaryOp.elaborate(self, platform)
+
+        m = Module()
+
+        iwidth = self.i.a.shape().width
+        if self.is_signed:
+            shape = signed(2 * iwidth)
+        else:
+            shape = unsigned(2 * iwidth)
+
+        # all the stages advance when the output register is free
+        ce = Signal()
+        m.d.comb += ce.eq(self.o.ready | ~self.o.valid)
+        m.d.comb += self.i.ready.eq(ce)
+
+        a, b = self.i.a, self.i.b
+        if self.is_signed:
+            a = a.as_signed()
+        valid, first, last = self.i.valid, self.i.first, self.i.last
+        acc = Const(0, shape)
+        # 'b' holds the bits not yet multiplied, from bit 'base' up
+        base = 0
+
+        for k, (lo, hi) in enumerate(self.slices):
+            part = b[lo-base:hi-base]
+            if self.is_signed and (hi == iwidth):
+                # only the top slice carries the sign
+                part = part.as_signed()
+            product = acc + ((a * part) << lo)
+
+            if k == (self.stages - 1):
+                with m.If(ce):
+                    m.d.sync += [
+                        self.o.valid.eq(valid),
+                        self.o.first.eq(first),
+                        self.o.last.eq(last),
+                        self.o.data.eq(product),
+                    ]
+                break
+
+            # only register what the later stages need : 'a', the rest of 'b',
+            # the sum so far (a * b[:hi]) and the flags
+            sa = Signal(a.shape(), name=f"a_{k}")
+            sb = Signal(iwidth - hi, name=f"b_{k}")
+            if self.is_signed:
+                sacc = Signal(signed(iwidth + hi + 1), name=f"acc_{k}")
+            else:
+                sacc = Signal(iwidth + hi, name=f"acc_{k}")
+            sv = Signal(name=f"valid_{k}")
+            sf = Signal(name=f"first_{k}")
+            sl = Signal(name=f"last_{k}")
+            with m.If(ce):
+                m.d.sync += [
+                    sa.eq(a),
+                    sb.eq(b[hi-base:]),
+                    sacc.eq(product),
+                    sv.eq(valid),
+                    sf.eq(first),
+                    sl.eq(last),
+                ]
+            a, b, acc, valid, first, last = sa, sb, sacc, sv, sf, sl
+            base = hi
+
+        return m
+
 class Add(BinaryOp):
 
     def op(self, m, a, b):
@@ -87,6 +200,8 @@ class Add(BinaryOp):
 
 class MulSigned(Mul):
 
+    is_signed = True
+
     def op(self, m, a, b):
         sa = Signal(signed(a.shape().width))
         sb = Signal(signed(b.shape().width))
@@ -106,16 +221,23 @@ class AddSigned(Add):
 
 class Sum(Elaboratable):
 
-    def __init__(self, iwidth, owidth, name=None):
-        self.i = Stream(layout=[("data", iwidth),], name=add_name(name, "in"))
-        self.o = Stream(layout=[("data", owidth),], name=add_name(name, "out"))
+    def __init__(self, iwidth, owidth, name=None, mode=None):
+        assert mode in modes, ("unknown mode", mode)
+        self.mode = mode
+        # the sum is sent on 'last', but only 'last' waits for the output to be read
+        self.latency, self.ii = (1, 1) if mode else (1, 2)
+        self.i = Stream(layout=[("data", iwidth),], name=add_name(name, "in"), owner=self)
+        self.o = Stream(layout=[("data", owidth),], name=add_name(name, "out"), owner=self)
         self.zero = Const(0, owidth)
 
     def elaborate(self, platform):
         m = Module()
 
+        with m.If(self.o.valid & self.o.ready):
+            m.d.sync += self.o.valid.eq(0)
+
         with m.If(self.i.valid & self.i.ready):
-            m.d.sync += self.i.ready.eq(0)
+            stage_accept(m, self.i, self.mode)
 
             with m.If(self.i.first):
                 # reset the sum on 'first' data
@@ -128,11 +250,7 @@ class Sum(Elaboratable):
                 # 'last' data in packet, output the sum
                 m.d.sync += self.o.valid.eq(1)
 
-        with m.If(self.o.valid & self.o.ready):
-            m.d.sync += self.o.valid.eq(0)
-
-        with m.If((~self.i.ready) & ~self.o.valid):
-            m.d.sync += self.i.ready.eq(1)
+        stage_ready(m, self.i, self.o, self.mode)
 
         return m
 
@@ -173,11 +291,15 @@ class Max(BinaryOp):
 
 class UnaryOp(Elaboratable):
 
-    def __init__(self, layout, name=None, fields=[], **kwargs):
+    def __init__(self, layout, name=None, fields=[], mode=None, olayout=None, **kwargs):
+        # olayout : the output layout, if it isn't the input layout
+        assert mode in modes, ("unknown mode", mode)
+        self.mode = mode
+        self.latency, self.ii = stage_timing(mode)
         if name:
             self.name = name
-        self.i = Stream(layout=layout, name="i")
-        self.o = Stream(layout=layout, name="o")
+        self.i = Stream(layout=layout, name="i", owner=self)
+        self.o = Stream(layout=olayout or layout, name="o", owner=self)
         if (len(layout) == 1) and not fields:
             fields = [ layout[0][0] ]
         assert fields, (fields, "no fields specified")
@@ -189,13 +311,14 @@ class UnaryOp(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
+        with m.If(self.o.valid & self.o.ready):
+            m.d.sync += self.o.valid.eq(0)
+
         with m.If(self.i.valid & self.i.ready):
             exclude = [ "valid", "ready", ]
             m.d.sync += Stream.connect(self.i, self.o, exclude=exclude)
-            m.d.sync += [
-                self.i.ready.eq(0),
-                self.o.valid.eq(self.enable),
-            ]
+            m.d.sync += self.o.valid.eq(self.enable)
+            stage_accept(m, self.i, self.mode)
             for name, _ in self.i.get_layout():
                 si = getattr(self.i, name)
                 so = getattr(self.o, name)
@@ -204,11 +327,7 @@ class UnaryOp(Elaboratable):
                 else:
                     self.op(m, name, si, so)
 
-        with m.If(self.o.valid & self.o.ready):
-            m.d.sync += self.o.valid.eq(0)
-
-        with m.If((~self.i.ready) & ~self.o.valid):
-            m.d.sync += self.i.ready.eq(1)
+        stage_ready(m, self.i, self.o, self.mode)
 
         return m
 
@@ -217,8 +336,8 @@ class UnaryOp(Elaboratable):
 
 class Abs(UnaryOp):
 
-    def __init__(self, layout, name="Abs", fields=[]):
-        UnaryOp.__init__(self, layout, name, fields)
+    def __init__(self, layout, name="Abs", fields=[], mode=None):
+        UnaryOp.__init__(self, layout, name, fields, mode=mode)
 
     def op(self, m, name, si, so):
         w = si.shape().width
@@ -234,8 +353,8 @@ class Abs(UnaryOp):
 
 class Delta(UnaryOp):
 
-    def __init__(self, layout, name="Delta", fields=[]):
-        UnaryOp.__init__(self, layout, name, fields)
+    def __init__(self, layout, name="Delta", fields=[], mode=None):
+        UnaryOp.__init__(self, layout, name, fields, mode=mode)
 
     def elaborate(self, platform):
         m = UnaryOp.elaborate(self, platform)
@@ -255,8 +374,8 @@ class Delta(UnaryOp):
 
 class BitToN(UnaryOp):
 
-    def __init__(self, layout, name="BitToN", fields=[]):
-        UnaryOp.__init__(self, layout, name, fields)
+    def __init__(self, layout, name="BitToN", fields=[], mode=None):
+        UnaryOp.__init__(self, layout, name, fields, mode=mode)
         assert len(self.fields) == 1, "only one field allowed"
 
     def elaborate(self, platform):
@@ -276,9 +395,9 @@ class BitToN(UnaryOp):
 
 class Decimate(UnaryOp):
 
-    def __init__(self, n, layout, name=None):
+    def __init__(self, n, layout, name=None, mode=None):
         fields = layout[0][0]
-        UnaryOp.__init__(self, layout, name or f"Decimate({n})", fields=[fields])
+        UnaryOp.__init__(self, layout, name or f"Decimate({n})", fields=[fields], mode=mode)
         assert n > 1
         self.n = n - 1
         self.count = Signal(range(n+1))
@@ -315,14 +434,13 @@ class Enumerate(UnaryOp):
             else:
                 name = f"Enumerate()"
             kwargs["name"] = name
+        # the output adds the idx
+        kwargs["olayout"] = list(kwargs["layout"]) + idx
         super().__init__(**kwargs)
         assert len(idx) == 1, idx
         self.step = Const(kwargs.get('step', 1))
         self.idx_name, w = idx[0]
         self.offset = Const(offset)
-        layout = self.i.get_layout()
-        # overwrite the default output stream, adding the idx
-        self.o = Stream(layout=layout + idx, name="o")
 
         self.idx = Signal(w)
 
@@ -346,7 +464,7 @@ class BitState(Elaboratable):
         assert field_in_layout(layout, field), (field, "not in layout")
         self.field = field
         self.state_field = state_field
-        self.i = Stream(layout=layout, name="i")
+        self.i = Stream(layout=layout, name="i", owner=self)
         name, width = get_field(layout, field)
 
         # save the input i.field 
@@ -361,7 +479,7 @@ class BitState(Elaboratable):
                 olayout.append((name, w))
         olayout.append((state_field, 1))
 
-        self.o = Stream(layout=olayout, name="o")
+        self.o = Stream(layout=olayout, name="o", owner=self)
         self.bit = Signal(range(owidth+1))
         self.end = Const(owidth)
 
@@ -439,7 +557,7 @@ class BitState(Elaboratable):
 class ConstSource(Elaboratable):
 
     def __init__(self, layout, name=None, fields={}):
-        self.o = Stream(layout=layout, name="o")
+        self.o = Stream(layout=layout, name="o", owner=self)
         assert fields, "no const fields specified"
         self.fields = fields 
         outs = [ n for n,_ in layout ]
@@ -0,0 +1,145 @@
+
+import sys
+
+from streams.dot import Design
+
+__all__ = [ "Profiler", ]
+
+#
+#   Simulation stall profiler.
+#
+#   Finds every Stream in the design and every connection to or from them
+#   (dot.Design, using the current registry or the one passed as
+#   'connections', see stream.Connections), then samples valid / ready
+#   on each clock. Reports, for each connection :
+#       util : % of clocks with a transfer (valid & ready)
+#       stall : % of clocks back-pressured (valid & ~ready)
+#       starve : % of clocks waiting for data (ready & ~valid)
+#
+#   The connections are only known once the design has been elaborated,
+#   so create the Profiler after the Simulator :
+#
+#       sim = Simulator(dut)
+#       prof = Profiler(dut)
+#       sim.add_testbench(prof.run, background=True)
+#       ...
+#       prof.print_report()
+#       dot.graph(dut, "x.dot", "x.png", annotate=prof.annotate)
+
+class Profiler:
+
+    def __init__(self, m, domain="sync", connections=None):
+        self.domain = domain
+        d = Design(m, connections=connections)
+        # id(stream) -> (stream, path), and the path of its owner
+        self.streams = {}
+        self.owners = {}
+        for s, path, b in d.streams:
+            self.streams[id(s)] = (s, path)
+            self.owners[id(s)] = d.blocks[b][1]
+
+        self.edges = [ (source, sink) for source, sink, _ in d.edges ]
+
+        # sample each source stream once
+        self.sampled = []
+        seen = set()
+        for source, _ in self.edges:
+            if not id(source) in seen:
+                seen.add(id(source))
+                self.sampled.append(source)
+
+        self.counts = dict([ (id(s), [ 0, 0, 0 ]) for s in self.sampled ])
+        self.cycles = 0
+
+    def name(self, s):
+        if id(s) in self.streams:
+            return self.streams[id(s)][1]
+        return str(s.name)
+
+    def update(self, values):
+        self.cycles += 1
+        for i, s in enumerate(self.sampled):
+            v, r = values[2*i], values[(2*i)+1]
+            c = self.counts[id(s)]
+            if v and r:
+                c[0] += 1
+            elif v:
+                c[1] += 1
+            elif r:
+                c[2] += 1
+
+    def signals(self):
+        sigs = []
+        for s in self.sampled:
+            sigs += [ s.valid, s.ready ]
+        return sigs
+
+    async def run(self, ctx):
+        # run with sim.add_testbench(prof.run, background=True)
+        sigs = self.signals()
+        async for _, _, *values in ctx.tick(self.domain).sample(*sigs):
+            self.update(values)
+
+    def poll(self):
+        # or call from a tick() loop, after each Tick()
+        values = []
+        for sig in self.signals():
+            x = yield sig
+            values.append(x)
+        self.update(values)
+
+    def get_stats(self, s):
+        # (util, stall, starve) as % of clocks
+        n = max(1, self.cycles)
+        return tuple([ 100 * x / n for x in self.counts[id(s)] ])
+
+    def report(self):
+        r = []
+        for source, sink in self.edges:
+            util, stall, starve = self.get_stats(source)
+            r.append({
+                "source" : self.name(source),
+                "sink" : self.name(sink),
+                "util" : util,
+                "stall" : stall,
+                "starve" : starve,
+            })
+        return r
+
+    def bottleneck(self):
+        # The block that back-pressures its inputs most,
+        # while its own outputs are least back-pressured.
+        stall_in = {}
+        stall_out = {}
+        for source, sink in self.edges:
+            _, stall, _ = self.get_stats(source)
+            a = self.owners.get(id(source))
+            b = self.owners.get(id(sink))
+            if b:
+                stall_in[b] = max(stall_in.get(b, 0), stall)
+            if a:
+                stall_out[a] = max(stall_out.get(a, 0), stall)
+        best, score = None, 0
+        for block, stall in stall_in.items():
+            x = stall - stall_out.get(block, 0)
+            if x > score:
+                best, score = block, x
+        return best
+
+    def print_report(self, f=sys.stdout):
+        print(f"{self.cycles} cycles", file=f)
+        print(f"{'source':30s} {'sink':30s} {'util%':>6s} {'stall%':>6s} {'starve%':>7s}", file=f)
+        for d in self.report():
+            print(f"{d['source']:30s} {d['sink']:30s} {d['util']:6.1f} {d['stall']:6.1f} {d['starve']:7.1f}", file=f)
+        print("bottleneck :", self.bottleneck(), file=f)
+
+    def annotate(self, source, sink):
+        # for dot.graph() : label with util%, colour red (idle) to green (busy)
+        if not id(source) in self.counts:
+            return "", ""
+        util, stall, _ = self.get_stats(source)
+        hue = 0.33 * util / 100
+        width = 1 + (3 * stall / 100)
+        return f"{util:.0f}%", f'color="{hue:.3f} 1.000 0.800",penwidth={width:.1f}'
+
+#   FIN
@@ -1,7 +1,7 @@
 
 from amaranth import *
 
-from streams import Stream, Sink
+from streams import Stream, Sink, register
 
 #
 #
@@ -144,18 +144,18 @@ class Router(Elaboratable):
         self.addrs = addrs[:]
         self.mods = []
 
-        self.i = Stream(layout=layout, name="i") # input
-        self.e = Stream(layout=layout, name="e") # error stream
-        self.null = Stream(layout=layout, name="null") # null stream
+        self.i = Stream(layout=layout, name="i", owner=self) # input
+        self.e = Stream(layout=layout, name="e", owner=self) # error stream
+        self.null = Stream(layout=layout, name="null", owner=self) # null stream
         self.route_mask = Signal(len(addrs))
         self.ready = Signal(1 + len(self.addrs)) # outputs + error
         self.error = Signal()
 
-        self.head = Head(layout, data_field=addr_field)
+        self.head = register(self, Head(layout, data_field=addr_field), "head")
         self.mods += [ self.head ]
 
         if sink is True:
-            self.sink = Sink(layout=layout)
+            self.sink = register(self, Sink(layout=layout), "sink")
             self.mods += [ self.sink ]
         elif isinstance(sink, list):
             sink.append(self.e)
@@ -163,12 +163,9 @@ class Router(Elaboratable):
         self.o = {}
 
         for addr in addrs:
-            s = Stream(layout=layout, name=f"o_{addr}")
+            s = Stream(layout=layout, name=f"o_{addr}", owner=self)
             assert not addr in self.o
             self.o[addr] = s
-            # .. so the dot code can find the Stream
-            name = f"_o_{addr}"
-            setattr(self, name, s)
 
     def elaborate(self, platform):
         m = Module()
@@ -1,23 +1,192 @@
+#!/bin/env python3
+
+import os
+import contextlib
+
+from amaranth import Module, ClockDomain, Shape
+from amaranth.sim import Simulator, Tick
+
+#
+#   VCD files are only written if STREAMS_VCD is set in the environment,
+#   eg. by "test.py --vcd". Use in place of sim.write_vcd() :
+#
+#       with write_vcd(sim, "gtk/x.vcd", traces=[]):
+#           sim.run()
+
+def write_vcd(sim, path, **kwargs):
+    if os.environ.get("STREAMS_VCD"):
+        return sim.write_vcd(path, **kwargs)
+    return contextlib.nullcontext()
+
+#
+#   Capture into a growable NumPy structured array.
+#
+#   One column per layout field (including first/last), plus
+#   '_t' the poll count and '_p' the packet index.
+#   Signed fields are int64 columns, sign extended as SinkSim reads them.
+#   append() is O(1) amortised : the array doubles in size when full.
+
+class NumpyCapture:
+
+    def __init__(self, layout, size=1024):
+        import numpy as np
+        self.np = np
+        self._layout = get_shapes(layout)
+        fields = [ ("_t", np.int64), ("_p", np.int64), ]
+        for name, width, signed in self._layout:
+            if width > 64:
+                fields.append((name, object))
+            else:
+                fields.append((name, np.int64 if signed else np.uint64))
+        self.dtype = np.dtype(fields)
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self._a = self.np.zeros(self.size, dtype=self.dtype)
+        self.n = 0
+        self._starts = []
+
+    def append(self, t, new_packet, value):
+        if self.n == len(self._a):
+            a = self.np.zeros(2 * len(self._a), dtype=self.dtype)
+            a[:self.n] = self._a
+            self._a = a
+        if new_packet or not self._starts:
+            self._starts.append(self.n)
+        row = self._a[self.n]
+        row["_t"] = t
+        row["_p"] = len(self._starts) - 1
+        for name, size, signed in self._layout:
+            x = value & ((1 << size) - 1)
+            row[name] = to_signed(x, size) if signed else x
+            value >>= size
+        self.n += 1
+
+    def get_array(self, field=None):
+        a = self._a[:self.n]
+        if field:
+            return a[field]
+        return a
+
+    def get_data(self, field=None):
+        a = self.get_array(field)
+        ends = self._starts[1:] + [ self.n ]
+        return [ a[s:e] for s, e in zip(self._starts, ends) ]
+
+#
+#   Seeded valid / ready patterns, next() gives the state for each clock.
+#
+#   "bernoulli" : on with probability p
+#   "bursty" : on for bursts of mean length 'burst', on for a fraction p overall
+#   "periodic" : on for the first p * period clocks of every period
+
+class Pattern:
+
+    kinds = [ "bernoulli", "bursty", "periodic", ]
+
+    def __init__(self, kind="bernoulli", p=0.5, burst=4, period=4, seed=0):
+        assert kind in self.kinds, ("unknown pattern", kind)
+        assert 0 < p <= 1, ("p out of range", p)
+        import random
+        self.rng = random.Random(seed)
+        self.kind = kind
+        self.p = p
+        self.period = period
+        self.on = round(p * period)
+        # bursty : chance of leaving the on / off states
+        self.p_off = 1 / burst
+        self.p_on = 1 if p == 1 else min(1, p / (burst * (1 - p)))
+        self.state = True
+        self.t = 0
+
+    def next(self):
+        t = self.t
+        self.t += 1
+        if self.kind == "bernoulli":
+            return self.rng.random() < self.p
+        if self.kind == "periodic":
+            return (t % self.period) < self.on
+        # bursty
+        if self.state:
+            self.state = self.rng.random() >= self.p_off
+        else:
+            self.state = self.rng.random() < self.p_on
+        return self.state
+
+#
+#   Handshake statistics, updated on every poll()
+
+class Stats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.cycles = 0
+        self.transfers = 0
+        self.stalls = 0     # valid & ~ready
+        self.valid = 0      # clocks with valid set
+
+    def update(self, valid, ready):
+        self.cycles += 1
+        if valid:
+            self.valid += 1
+            if ready:
+                self.transfers += 1
+            else:
+                self.stalls += 1
+
+    def get(self):
+        n = max(1, self.cycles)
+        return {
+            "cycles" : self.cycles,
+            "transfers" : self.transfers,
+            "throughput" : self.transfers / n,
+            "stalls" : self.stalls,
+            "occupancy" : self.valid / n,
+        }
+
 #
 #   Test Class, acts as passive Monitor
+#
+#   capture=None : records a dict per word, get_data() returns lists
+#   capture="numpy" : records into a NumpyCapture, get_data() returns array views
 
 class MonitorSim:
-    def __init__(self, stream, name="MonitorSim"):
+    def __init__(self, stream, name="MonitorSim", capture=None):
+        assert capture in [ None, "numpy" ], ("unknown capture", capture)
         self.m = stream
         self.name = name
+        self.capture = capture
         self._data = [ [] ]
         self._layout = stream.get_layout(flags=True)
+        if capture == "numpy":
+            self._np = NumpyCapture(self._layout)
+            self._payload = stream.cat_payload(flags=True)
+        self.stats = Stats()
         self.t = 0
 
     def reset(self):
         self._data = [ [] ]
+        self.stats.reset()
+        if self.capture == "numpy":
+            self._np.reset()
+
+    def get_stats(self):
+        return self.stats.get()
 
     def poll(self):
         self.t += 1
         r = yield self.m.ready
         v = yield self.m.valid
         f = yield self.m.first
+        self.stats.update(v, r)
         if r and v:
+            if self.capture == "numpy":
+                d = yield self._payload
+                self._np.append(self.t, f, d)
+                return
             if f:
                 if len(self._data[0]):
                     self._data += [ [ ] ]
@@ -29,19 +198,30 @@ class MonitorSim:
             self._data[-1].append(record)
 
     def get_data(self, field=None): 
+        if self.capture == "numpy":
+            return self._np.get_data(field)
         if field:
             return [ [ d[field] for d in p ] for p in self._data ]
         return self._data
 
+    def get_array(self, field=None):
+        # the whole capture as one array (capture="numpy" only)
+        assert self.capture == "numpy"
+        return self._np.get_array(field)
+
 #
 #   Test Class, acts as Sink
+#
+#   pattern : a Pattern to drive 'ready' on every clock, instead of
+#   the default (drop ready after each transfer, then wait 'slow' clocks)
 
 class SinkSim(MonitorSim):
-    def __init__(self, stream, name="SinkSim", read_data=True, slow=0):
-        MonitorSim.__init__(self, stream, name=name)
+    def __init__(self, stream, name="SinkSim", read_data=True, slow=0, capture=None, pattern=None):
+        MonitorSim.__init__(self, stream, name=name, capture=capture)
         self.read_data = read_data
         self.slow = slow
         self.wait = 0
+        self.pattern = pattern
 
     def reset(self):
         MonitorSim.reset(self)
@@ -49,6 +229,10 @@ class SinkSim(MonitorSim):
 
     def poll(self):
         yield from MonitorSim.poll(self)
+        if self.pattern:
+            ready = self.pattern.next() and self.read_data
+            yield self.m.ready.eq(ready)
+            return
         r = yield self.m.ready
         v = yield self.m.valid
         if r and v:
@@ -64,16 +248,25 @@ class SinkSim(MonitorSim):
 
 #
 #   Test Class : acts as source
+#
+#   pattern : a Pattern to decide on which clocks a new word may be sent.
+#   With a pattern, the next word can follow a transfer on the next clock.
+#   Once valid is set it is held until the word is accepted.
 
 class SourceSim:
 
-    def __init__(self, stream, verbose=False, name="Source"):
+    def __init__(self, stream, verbose=False, name="Source", pattern=None):
         self.m = stream
         self.verbose = verbose
         self.name = name
         self._data = []
         self.idx = 0
         self.t = 0
+        self.pattern = pattern
+        self.stats = Stats()
+
+    def get_stats(self):
+        return self.stats.get()
 
     def push(self, t, **kwargs):
         self._data.append((t, kwargs))
@@ -81,6 +274,7 @@ class SourceSim:
     def reset(self):
         self._data = []
         self.idx = 0
+        self.stats.reset()
         yield self.m.valid.eq(0)
 
     def done(self):
@@ -92,6 +286,11 @@ class SourceSim:
         r = yield self.m.ready
 
         self.t += 1
+        self.stats.update(v, r)
+
+        if self.pattern:
+            yield from self.poll_pattern(v, r)
+            return
 
         if v and r:
             yield self.m.valid.eq(0)
@@ -116,4 +315,355 @@ class SourceSim:
         yield self.m.valid.eq(1)
         self.idx += 1
 
+    def poll_pattern(self, v, r):
+        if v and not r:
+            # hold the word until it is accepted
+            return
+
+        send = self.pattern.next()
+        if send and (self.idx < len(self._data)):
+            tt, data = self._data[self.idx]
+            send = tt <= self.t
+        else:
+            send = False
+
+        if not send:
+            if v:
+                yield self.m.valid.eq(0)
+            return
+
+        tt, data = self._data[self.idx]
+        if self.verbose:
+            print(self.name, "tx", tt, data)
+        v = self.m.cat_dict(data, flags=True)
+        for cmd in self.m.payload_eq(v, flags=True):
+            yield cmd
+        yield self.m.valid.eq(1)
+        self.idx += 1
+
+#
+#   Rate test for a block with 'i' and 'o' Streams : a new word is offered
+#   on every clock, and o.ready is dropped every 'stall' clocks (if set).
+#   The words are sent as one packet (first / last) if 'packet' is set.
+#
+#   Returns (the output words as dicts, the clocks taken).
+
+def sim_rate(m, words, stall=None, setup=[], packet=False, limit=500, vcd="gtk/rate.vcd"):
+    ready = None
+    if stall:
+        ready = lambda t, idx: (t % stall) != (stall - 1)
+    rx, t, _ = sim_rate_ports(m, [ m.i ], [ m.o ], [ words ], ready=ready, setup=setup,
+                              packet=packet, limit=limit, vcd=vcd)
+    return rx[0], t
+
+#
+#   The same for any number of input and output Streams.
+#
+#   words : a list of dicts for each input
+#   valid(t, idx) : False for a gap on input idx at clock t
+#   ready(t, idx) : the ready of output idx at clock t
+#   count : stop once every output has this many words (default, all the
+#   words of the first input), otherwise run for 'limit' clocks.
+#
+#   Returns (the words for each output, the clocks taken,
+#   the clocks on which each input accepted a word).
+
+def sim_rate_ports(m, inputs, outputs, words, valid=None, ready=None, setup=[], packet=False,
+                   count=-1, limit=500, vcd="gtk/rate.vcd"):
+    # combinatorial designs have no 'sync' domain of their own
+    top = Module()
+    top.domains.sync = ClockDomain()
+    top.submodules.dut = m
+    sim = Simulator(top)
+
+    if count == -1:
+        count = len(words[0])
+    names = [ [ name for name, _ in s.fields() ] + [ "first", "last" ] for s in outputs ]
+    result = {}
+
+    def proc():
+        for cmd in setup:
+            yield cmd
+        rx = [ [] for _ in outputs ]
+        accepts = [ [] for _ in inputs ]
+        tx = [ 0 ] * len(inputs)
+        t = 0
+        while t < limit:
+            if (count is not None) and (min([ len(x) for x in rx ]) >= count):
+                break
+            on = []
+            for idx, s in enumerate(inputs):
+                n = len(words[idx])
+                on.append((tx[idx] < n) and ((valid is None) or valid(t, idx)))
+                if tx[idx] < n:
+                    d = dict(words[idx][tx[idx]])
+                    if packet:
+                        d["first"] = tx[idx] == 0
+                        d["last"] = tx[idx] == (n - 1)
+                    for name, value in d.items():
+                        yield getattr(s, name).eq(value)
+                yield s.valid.eq(on[idx])
+            for idx, s in enumerate(outputs):
+                yield s.ready.eq((ready is None) or ready(t, idx))
+
+            for idx, s in enumerate(outputs):
+                o_rdy = yield s.ready
+                o_valid = yield s.valid
+                if o_rdy & o_valid:
+                    r = {}
+                    for name in names[idx]:
+                        r[name] = yield getattr(s, name)
+                    rx[idx].append(r)
+            for idx, s in enumerate(inputs):
+                i_rdy = yield s.ready
+                if i_rdy & on[idx]:
+                    tx[idx] += 1
+                    accepts[idx].append(t)
+
+            yield Tick()
+            t += 1
+
+        result["r"] = rx, t, accepts
+
+    sim.add_clock(1 / 100e6)
+    sim.add_testbench(proc)
+    with write_vcd(sim, vcd, traces=[]):
+        sim.run()
+    return result["r"]
+
+#
+#   Pack / unpack a dict of fields as a single int, in cat_payload() order.
+#   Signed fields are sign extended on unpack, as SinkSim reads them.
+
+def get_shapes(layout):
+    # (name, width, signed) for each field
+    r = []
+    for name, shape in layout:
+        shape = Shape.cast(shape)
+        r.append((name, shape.width, shape.signed))
+    return r
+
+def to_signed(v, size):
+    if v & (1 << (size - 1)):
+        return v - (1 << size)
+    return v
+
+def pack(layout, d):
+    v = 0
+    shift = 0
+    for name, size, _ in get_shapes(layout):
+        v |= (int(d.get(name, 0)) & ((1 << size) - 1)) << shift
+        shift += size
+    return v
+
+def unpack(layout, v):
+    d = {}
+    for name, size, signed in get_shapes(layout):
+        x = v & ((1 << size) - 1)
+        d[name] = to_signed(x, size) if signed else x
+        v >>= size
+    return d
+
+#
+#   Bulk Source : takes a whole list of packets up front.
+#
+#   Each packet is a list of dicts, or a list of ints for the 'field' payload.
+#   The words are packed in advance and the payload is driven as a single
+#   value. valid is only written when it changes, so it runs at one word
+#   per clock for a sink that is always ready.
+#   Use in place of SourceSim, calling poll() after each Tick().
+
+class BulkSourceSim:
+
+    def __init__(self, stream, packets=[], field="data", verbose=False, name="BulkSource"):
+        self.m = stream
+        self.verbose = verbose
+        self.name = name
+        self._layout = stream.get_layout(flags=True)
+        self._payload = stream.cat_payload(flags=True)
+        self._words = []
+        self.idx = 0
+        self.valid = False
+        self.push_packets(packets, field=field)
+
+    def push_packets(self, packets, field="data"):
+        for p in packets:
+            p = list(p)
+            for i, x in enumerate(p):
+                d = x if isinstance(x, dict) else { field : x }
+                d = dict(d)
+                d["first"] = i == 0
+                d["last"] = i == (len(p) - 1)
+                self._words.append(pack(self._layout, d))
+
+    def reset(self):
+        self._words = []
+        self.idx = 0
+        self.valid = False
+        yield self.m.valid.eq(0)
+
+    def done(self):
+        return (self.idx >= len(self._words)) and not self.valid
+
+    def poll(self):
+        if self.valid:
+            r = yield self.m.ready
+            if not r:
+                return
+            self.idx += 1
+
+        if self.idx >= len(self._words):
+            if self.valid:
+                self.valid = False
+                yield self.m.valid.eq(0)
+            return
+
+        # Tx next word (including first/last flags)
+        if self.verbose:
+            print(self.name, "tx", unpack(self._layout, self._words[self.idx]))
+        yield self._payload.eq(self._words[self.idx])
+        if not self.valid:
+            self.valid = True
+            yield self.m.valid.eq(1)
+
+#
+#   Bulk Sink : holds ready hi (while read_data is set) and
+#   records each word as a single int, decoded by get_data().
+
+class BulkSinkSim:
+
+    def __init__(self, stream, read_data=True, name="BulkSink"):
+        self.m = stream
+        self.name = name
+        self.read_data = read_data
+        self._layout = stream.get_layout(flags=True)
+        self._payload = stream.cat_payload(flags=True)
+        self._words = []
+        self.ready = False
+        self.t = 0
+
+    def reset(self):
+        self._words = []
+        self.ready = False
+        yield self.m.ready.eq(0)
+
+    def poll(self):
+        self.t += 1
+        if self.ready:
+            v = yield self.m.valid
+            if v:
+                d = yield self._payload
+                self._words.append((self.t, d))
+
+        if self.ready != self.read_data:
+            self.ready = self.read_data
+            yield self.m.ready.eq(self.ready)
+
+    def get_data(self, field=None):
+        return get_packets(self._layout, self._words, field)
+
+#
+#   Split recorded (t, int) words into packets, on the 'first' flag
+
+def get_packets(layout, words, field=None):
+    # flags are the top 2 bits : first, last
+    first = 1 << (sum([ w for _, w, _ in get_shapes(layout) ]) - 2)
+    packets = []
+    for t, v in words:
+        if (v & first) or not packets:
+            packets.append([])
+        d = unpack(layout, v)
+        if field:
+            packets[-1].append(d[field])
+        else:
+            d["_t"] = t
+            packets[-1].append(d)
+    return packets
+
+#
+#   async versions, for sim.add_testbench().
+#
+#   Each runs as its own coroutine, so there is no tick() loop calling
+#   poll() on every stream. They sleep on ctx.changed() while their
+#   stream is idle, so idle streams cost nothing per clock.
+#
+#   AsyncSourceSim.run() returns once all its packets have been sent.
+#   The Sink / Monitor run forever, so add them with background=True :
+#
+#       sim.add_testbench(src.run)
+#       sim.add_testbench(sink.run, background=True)
+
+class AsyncSourceSim(BulkSourceSim):
+
+    def __init__(self, stream, packets=[], field="data", domain="sync", verbose=False, name="AsyncSource"):
+        BulkSourceSim.__init__(self, stream, packets, field=field, verbose=verbose, name=name)
+        self.domain = domain
+
+    async def run(self, ctx):
+        while self.idx < len(self._words):
+            w = self._words[self.idx]
+            if self.verbose:
+                print(self.name, "tx", unpack(self._layout, w))
+            ctx.set(self._payload, w)
+            ctx.set(self.m.valid, 1)
+            self.valid = True
+            # ready is sampled at the clock edge
+            await ctx.tick(self.domain).until(self.m.ready)
+            self.idx += 1
+        ctx.set(self.m.valid, 0)
+        self.valid = False
+
+#
+#   Passive monitor : records each transfer.
+#   '_t' is the number of the transfer, not the clock.
+
+class AsyncMonitorSim:
+
+    def __init__(self, stream, domain="sync", name="AsyncMonitorSim"):
+        self.m = stream
+        self.name = name
+        self.domain = domain
+        self._layout = stream.get_layout(flags=True)
+        self._payload = stream.cat_payload(flags=True)
+        self._words = []
+
+    def reset(self):
+        self._words = []
+
+    async def run(self, ctx):
+        valid, ready = self.m.valid, self.m.ready
+        while True:
+            if not (ctx.get(valid) and ctx.get(ready)):
+                await ctx.changed(valid, ready)
+                continue
+            _, _, v, r, d = await ctx.tick(self.domain).sample(valid, ready, self._payload)
+            if v and r:
+                self._words.append((len(self._words), d))
+                await self.on_transfer(ctx)
+
+    async def on_transfer(self, ctx):
+        pass
+
+    def get_data(self, field=None):
+        return get_packets(self._layout, self._words, field)
+
+#
+#   Sink : holds ready hi, dropping it for 'slow' clocks after each transfer
+
+class AsyncSinkSim(AsyncMonitorSim):
+
+    def __init__(self, stream, slow=0, domain="sync", name="AsyncSinkSim"):
+        AsyncMonitorSim.__init__(self, stream, domain=domain, name=name)
+        self.slow = slow
+
+    async def run(self, ctx):
+        ctx.set(self.m.ready, 1)
+        await AsyncMonitorSim.run(self, ctx)
+
+    async def on_transfer(self, ctx):
+        if self.slow:
+            ctx.set(self.m.ready, 0)
+            await ctx.tick(self.domain).repeat(self.slow)
+            ctx.set(self.m.ready, 1)
+
 #   FIN
@@ -1,4 +1,5 @@
 
+import weakref
 from enum import IntEnum
 
 from amaranth import *
@@ -20,59 +21,276 @@ def add_name(name, label):
     return name + "_" + label
 
 #
+#   Explicit registration of the Streams and sub-modules of a block, for dot.
 #
+#   A block that registers anything is walked through its registry only,
+#   not found by reflection, so it must register all its Streams and
+#   sub-modules, including any held in lists or dicts. Set STREAMS_CHECK
+#   in the environment to have dot warn about any Stream attributes missed :
+#
+#       self.i = Stream(layout, name="i", owner=self)
+#       self.o = [ Stream(layout, name=f"o{i}", owner=self) for i in range(n) ]
+#       self.fifo = register(self, StreamFifo(layout, 8), "fifo")
+
+def register(owner, obj, attr=None):
+    owner.__dict__.setdefault("_dot_registry", []).append((attr, obj))
+    return obj
+
+def get_registry(owner):
+    # [ (attr, obj), ] or None if nothing was registered
+    return getattr(owner, "__dict__", {}).get("_dot_registry")
+
+#
+#   Registry of Stream.connect() calls, used by dot and profiler.
+#
+#   Each entry is (source, sink, statements, exclude, fn), indexed by
+#   source and by sink. Connections are recorded in the innermost active
+#   registry, so scope one to the elaboration of a design :
+#
+#       with Connections() as c:
+#           sim = Simulator(dut)
+#       dot.graph(dut, "x.dot", "x.png", connections=c)
+#
+#   Outside any 'with' block they go to the default Stream.connections.
+#   It holds its streams by weak reference (weak=True), so the connections
+#   of a design are dropped once the design is garbage collected.
+
+class Connections:
+
+    active = []
+
+    @staticmethod
+    def current():
+        if Connections.active:
+            return Connections.active[-1]
+        return Stream.connections
+
+    def __init__(self, weak=False):
+        self.weak = weak
+        self.clear()
+
+    def clear(self):
+        # index -> (id(source), id(sink), entry), in the order they were made
+        self.edges = {}
+        self.n = 0
+        # id(stream) -> [ index into edges, ]
+        self.sources = {}
+        self.sinks = {}
+        # weak : the streams being watched, and those since collected.
+        # The finalizers can run at any allocation, so they only queue
+        # the stream : purge() drops its connections.
+        self.watched = set()
+        self.dead = []
+
+    def watch(self, s):
+        if id(s) in self.watched:
+            return
+        self.watched.add(id(s))
+        weakref.finalize(s, self.dead.append, id(s))
+
+    def purge(self):
+        while self.dead:
+            key = self.dead.pop()
+            self.watched.discard(key)
+            for n in self.sources.pop(key, []) + self.sinks.pop(key, []):
+                e = self.edges.pop(n, None)
+                if e is None:
+                    continue
+                for d, k in [ (self.sources, e[0]), (self.sinks, e[1]) ]:
+                    if n in d.get(k, []):
+                        d[k].remove(n)
+
+    def add(self, source, sink, statements, exclude=None, fn=None):
+        self.purge()
+        n = self.n
+        self.n += 1
+        if self.weak:
+            self.watch(source)
+            self.watch(sink)
+            entry = (weakref.ref(source), weakref.ref(sink), statements, exclude, fn)
+        else:
+            entry = (source, sink, statements, exclude, fn)
+        self.edges[n] = (id(source), id(sink), entry)
+        self.sources.setdefault(id(source), []).append(n)
+        self.sinks.setdefault(id(sink), []).append(n)
+
+    def get(self, n):
+        # (source, sink, statements, exclude, fn)
+        entry = self.edges[n][2]
+        if self.weak:
+            source, sink, statements, exclude, fn = entry
+            return (source(), sink(), statements, exclude, fn)
+        return entry
+
+    def from_source(self, s):
+        self.purge()
+        return [ self.get(n) for n in self.sources.get(id(s), []) ]
+
+    def to_sink(self, s):
+        self.purge()
+        return [ self.get(n) for n in self.sinks.get(id(s), []) ]
+
+    def find(self, streams):
+        # connections to or from any of 'streams', in the order they were made
+        self.purge()
+        idx = set()
+        for s in streams:
+            idx.update(self.sources.get(id(s), []))
+            idx.update(self.sinks.get(id(s), []))
+        return [ self.get(n) for n in sorted(idx) ]
+
+    def __iter__(self):
+        self.purge()
+        return iter([ self.get(n) for n in list(self.edges) ])
+
+    def __len__(self):
+        self.purge()
+        return len(self.edges)
+
+    def __enter__(self):
+        Connections.active.append(self)
+        return self
+
+    def __exit__(self, *args):
+        Connections.active.remove(self)
+
+#
+#   Immutable, hashable Stream layout : a sequence of (name, width) fields.
+#   Computed once and shared by all the Streams with an equal layout.
+#   Can be used anywhere a list layout is, eg. Stream(layout=s.layout).
+
+class StreamLayout:
+
+    __slots__ = ( "fields", "flagged", "names", "index", "width", )
+
+    cache = {}
+
+    @staticmethod
+    def get(layout):
+        if isinstance(layout, StreamLayout):
+            return layout
+        key = tuple([ (name, width) for name, width in layout ])
+        info = StreamLayout.cache.get(key)
+        if info is None:
+            info = StreamLayout(key)
+            StreamLayout.cache[key] = info
+        return info
+
+    def __init__(self, fields):
+        init = lambda name, value: object.__setattr__(self, name, value)
+        init("fields", fields)
+        init("flagged", fields + (("first", 1), ("last", 1)))
+        init("names", tuple([ name for name, _ in fields ]))
+        # name -> position in the fields
+        init("index", dict([ (name, i) for i, name in enumerate(self.names) ]))
+        init("width", sum([ Shape.cast(width).width for _, width in fields ]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"StreamLayout is immutable, can't set '{name}'")
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __getitem__(self, idx):
+        return self.fields[idx]
+
+    def __eq__(self, other):
+        if isinstance(other, StreamLayout):
+            return self.fields == other.fields
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.fields)
+
+    def __repr__(self):
+        return f"StreamLayout({list(self.fields)})"
+
+#
+#   The payload signals are held in a tuple, in layout order, not as
+#   instance attributes, but can still be accessed as eg. s.data
 
 class Stream:
 
-    connections = []
+    __slots__ = (
+        "name", "ready", "valid", "first", "last",
+        "_info", "_payload", "_flagged", "__weakref__",
+    )
 
     @staticmethod
     def add_dot(source, sink, statements, exclude=None, fn=None):
-        Stream.connections += [ (source, sink, statements, exclude, fn), ]
+        Connections.current().add(source, sink, statements, exclude=exclude, fn=fn)
 
-    def __init__(self, layout, name=None):
-        self._layout = layout
+    def __init__(self, layout, name=None, owner=None):
+        if owner is not None:
+            register(owner, self, name)
+        self._info = StreamLayout.get(layout)
         self.name = name
         self.ready = Signal(name=add_name(name, "ready"))
         self.valid = Signal(name=add_name(name, "valid"))
         self.first = Signal(name=add_name(name, "first"))
         self.last = Signal(name=add_name(name, "last"))
-        for payload, width in layout:
-            setattr(self, payload, Signal(width, name=add_name(name, payload)))
+        # payload signals, in layout order, with and without the flags
+        self._payload = tuple([ Signal(width, name=add_name(name, field)) for field, width in self._info.fields ])
+        self._flagged = self._payload + (self.first, self.last)
+
+    def __getattr__(self, name):
+        # only called if 'name' isn't a slot, ie. for the payload fields
+        if not name in ( "_info", "_payload", ):
+            try:
+                return self._payload[self._info.index[name]]
+            except (KeyError, AttributeError):
+                pass
+        raise AttributeError(f"Stream '{self.name}' has no field '{name}'")
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self._info.names)
+
+    @property
+    def layout(self):
+        return self._info
+
+    def fields(self, flags=False):
+        # the (name, width) fields, as a tuple : no copy
+        if flags:
+            return self._info.flagged
+        return self._info.fields
+
+    def signals(self, flags=False):
+        # the payload signals, in layout order, as a tuple : no copy
+        if flags:
+            return self._flagged
+        return self._payload
 
     @staticmethod
     def connect(source, sink, exclude=[], mapping={}, fn={}, silent=False):
         # use with eg.
         # m.d.comb += src.connect(sink, exclude=["first","last"], mapping={"x":"data"}, fn={"x":shift_x})
         statements = []
+        append = statements.append
 
         used = {}
 
         def op(name, i, o):
             f = fn.get(name)
             if f is None:
-                return [ o.eq(i) ]
+                return o.eq(i)
             used[name] = True
-            return [ f(name, i, o) ]
+            return f(name, i, o)
 
         for name in [ "valid", "first", "last" ]:
             if not name in exclude:
-                i = getattr(source, name)
-                o = getattr(sink, name)
-                statements += op(name, i, o)
+                append(op(name, getattr(source, name), getattr(sink, name)))
 
-        for name in [ "ready" ]:
-            if not name in exclude:
-                i = getattr(sink, name)
-                o = getattr(source, name)
-                statements += op(name, i, o)
+        if not "ready" in exclude:
+            append(op("ready", sink.ready, source.ready))
 
-        for name, _ in source.get_layout():
+        for name, i in zip(source._info.names, source._payload):
             if not name in exclude:
-                oname = mapping.get(name, name)
-                i = getattr(source, name)
-                o = getattr(sink, oname)
-                statements += op(name, i, o)
+                o = getattr(sink, mapping.get(name, name))
+                append(op(name, i, o))
 
         # Used by the dot graph generation to track connections
         if not silent:
@@ -87,25 +305,16 @@ class Stream:
         return Stream.connect(self, sink, exclude=exclude, mapping=mapping, fn=fn, silent=silent)
 
     def get_layout(self, flags=False):
-        layout = self._layout[:]
-        if flags:
-            layout += [ ("first", 1), ("last", 1) ]
-        return layout
+        # a copy, as a list. Use fields() to avoid the copy.
+        return list(self.fields(flags))
 
     def cat_payload(self, flags=False):
-        data = []
-        for name, _ in self.get_layout(flags):
-            data.append(getattr(self, name))
-        return Cat(*data)
+        return Cat(*self.signals(flags))
 
     def payload_eq(self, data, flags=False):
-        statements = []
-        idx = 0
-        for name, size in self.get_layout(flags):
-            s = getattr(self, name)
-            statements += [ s.eq(data[idx:idx+size]) ]
-            idx += size
-        return statements
+        # a single assignment to the concatenated fields,
+        # rather than one slice of 'data' per field
+        return [ self.cat_payload(flags).eq(data) ]
 
     def cat_dict(self, d, flags=False):
         data = []
@@ -115,20 +324,90 @@ class Stream:
         return Cat(*data)
 
     def __repr__(self):
-        return f'Stream("{self.name}", {self._layout})'
+        return f'Stream("{self.name}", {list(self._info.fields)})'
+
+# default registry, used outside a 'with Connections()' block
+Stream.connections = Connections(weak=True)
 
 #
 #
 
-class Copy(Elaboratable):
+class SkidBuffer(Elaboratable):
+
+    """
+    Pipeline register with a second 'skid' register.
+    i.ready only depends on the skid register, so there is no combinatorial
+    path from o.ready to i.ready, yet it sustains one transfer per clock.
+    If the output stalls, the word in flight is parked in the skid register.
+    """
 
     def __init__(self, layout, name=None):
-        self.i = Stream(layout, name=add_name(name, "in"))
-        self.o = Stream(layout, name=add_name(name, "out"))
+        self.i = Stream(layout, name=add_name(name, "in"), owner=self)
+        self.o = Stream(layout, name=add_name(name, "out"), owner=self)
+        # payload plus first / last
+        width = self.i.layout.width + 2
+        self.skid = Signal(width)
+        self.skid_valid = Signal()
+        # timing, for export.Graph
+        self.latency, self.ii = 1, 1
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # accept input as long as the skid register is empty
+        m.d.comb += self.i.ready.eq(~self.skid_valid)
+
+        with m.If(self.o.ready | ~self.o.valid):
+            # output register is empty, or being read this cycle
+            with m.If(self.skid_valid):
+                m.d.sync += self.o.payload_eq(self.skid, flags=True)
+                m.d.sync += [
+                    self.o.valid.eq(1),
+                    self.skid_valid.eq(0),
+                ]
+            with m.Else():
+                m.d.sync += self.o.valid.eq(self.i.valid)
+                with m.If(self.i.valid):
+                    m.d.sync += self.o.payload_eq(self.i.cat_payload(flags=True), flags=True)
+
+        with m.Elif(self.i.valid & self.i.ready):
+            # output is stalled : park the input in the skid register
+            m.d.sync += [
+                self.skid.eq(self.i.cat_payload(flags=True)),
+                self.skid_valid.eq(1),
+            ]
+
+        return m
+
+    def ports(self):
+        return []
+
+#
+#   Copy input to output.
+#
+#   mode=None : register stage, one transfer every third clock
+#   mode="skid" : SkidBuffer, one transfer per clock
+
+class Copy(Elaboratable):
+
+    def __init__(self, layout, name=None, mode=None):
+        assert mode in [ None, "skid" ], ("unknown mode", mode)
+        self.mode = mode
+        self.i = Stream(layout, name=add_name(name, "in"), owner=self)
+        self.o = Stream(layout, name=add_name(name, "out"), owner=self)
+        if mode == "skid":
+            self.skid = register(self, SkidBuffer(layout, name=add_name(name, "skid")), "skid")
+        self.latency, self.ii = 1, (1 if mode else 3)
 
     def elaborate(self, platform):
         m = Module()
 
+        if self.mode == "skid":
+            m.submodules += self.skid
+            m.d.comb += Stream.connect(self.i, self.skid.i)
+            m.d.comb += Stream.connect(self.skid.o, self.o)
+            return m
+
         with m.If(self.o.valid & self.o.ready):
             m.d.sync += self.o.valid.eq(0)
 
@@ -267,21 +546,53 @@ class StreamNull(Elaboratable):
 
 #
 #   Copy input to multiple outputs
+#
+#   depth=N : each output has its own N word StreamFifo. The input is
+#   broadcast to all the fifos, one word per clock, while they all have
+#   space, so a slow output only stalls the input once its fifo fills.
+#   Use N >= 2 for full rate. Nothing is dropped.
 
 class Tee(Elaboratable):
 
-    def __init__(self, n, layout, wait_all=False, name=None):
+    def __init__(self, n, layout, wait_all=False, name=None, depth=0):
+        from .fifo import StreamFifo
         self.wait_all = wait_all
-        self.i = Stream(layout, name=add_name(name, "in"))
+        self.depth = depth
+        self.i = Stream(layout, name=add_name(name, "in"), owner=self)
         self.o = []
         for i in range(n):
-            s = Stream(layout, name=add_name(name, f"out[{i}]"))
+            s = Stream(layout, name=add_name(name, f"out[{i}]"), owner=self)
             self.o += [ s ]
-            setattr(self, f"_o{i}", s) # so that dot graph can find it!
+
+        self.latency, self.ii = 1, (1 if depth else 3)
+
+        self.fifos = []
+        if depth:
+            for i in range(n):
+                f = StreamFifo(layout, depth, name=add_name(name, f"fifo[{i}]"))
+                self.fifos += [ register(self, f, f"fifos[{i}]") ]
+
+    def elaborate_fifo(self, m):
+        m.submodules += self.fifos
+
+        # all the fifos have space
+        space = Signal()
+        m.d.comb += space.eq(Cat([ f.i.ready for f in self.fifos ]).all())
+        m.d.comb += self.i.ready.eq(space)
+
+        for f, s in zip(self.fifos, self.o):
+            m.d.comb += Stream.connect(self.i, f.i, exclude=[ "valid", "ready", ])
+            m.d.comb += f.i.valid.eq(self.i.valid & space)
+            m.d.comb += Stream.connect(f.o, s)
+
+        return m
 
     def elaborate(self, platform):
         m = Module()
 
+        if self.depth:
+            return self.elaborate_fifo(m)
+
         with m.If(self.i.valid & self.i.ready):
             m.d.sync += self.i.ready.eq(0)
             for s in self.o:
@@ -335,8 +646,16 @@ class Join(Elaboratable):
                 return True
         return False
 
-    def __init__(self, first_field=None, name=None, **kwargs):
+    def __init__(self, first_field=None, name=None, mode=None, **kwargs):
         # eg Join(a=[("x", 12)], b=[("y", 12)])
+        #
+        # mode=None : registered readies, a joined word every 2-3 clocks
+        # mode="pipe" : i.ready is (all inputs valid) & (o.ready | ~o.valid),
+        #               combinatorial. The output is registered.
+        #               One joined word per clock.
+        assert mode in [ None, "pipe" ], ("unknown mode", mode)
+        self.mode = mode
+        self.latency, self.ii = 1, (1 if mode else 3)
         self.i = []
         layouts = []
         self.fields = []
@@ -347,7 +666,7 @@ class Join(Elaboratable):
             assert self.is_layout(layout)
             # check for duplicate fields
             assert not self.has_field(layouts, layout)
-            s = Stream(layout=layout, name=add_name(name, payload))
+            s = Stream(layout=layout, name=add_name(name, payload), owner=self)
             setattr(self, payload, s)
             #print("join", s, payload, layout)
             self.i.append(s)
@@ -360,14 +679,44 @@ class Join(Elaboratable):
             first_field = x[0][0]
         self.first_field = first_field
 
-        self.o = Stream(layout=layouts, name=add_name(name, ','.join(self.fields)))
+        self.o = Stream(layout=layouts, name=add_name(name, ','.join(self.fields)), owner=self)
 
     def __repr__(self):
         return "Join(" + ",".join(self.fields) + ")"
 
+    def copy(self, m):
+        # copy all the inputs to the output
+        for idx in range(len(self.i)):
+            if self.fields[idx] == self.first_field:
+                exclude = [ "valid", "ready" ] # get first/last from this stream
+            else:
+                exclude = [ "valid", "ready", "first", "last" ]
+            m.d.sync += Stream.connect(self.i[idx], self.o, exclude=exclude)
+
+    def elaborate_pipe(self, m):
+        all_valid = Signal()
+        m.d.comb += all_valid.eq(Cat([ s.valid for s in self.i ]).all())
+
+        ce = Signal()
+        m.d.comb += ce.eq(self.o.ready | ~self.o.valid)
+
+        for s in self.i:
+            m.d.comb += s.ready.eq(all_valid & ce)
+
+        with m.If(all_valid & ce):
+            m.d.sync += self.o.valid.eq(1)
+            self.copy(m)
+        with m.Elif(self.o.valid & self.o.ready):
+            m.d.sync += self.o.valid.eq(0)
+
+        return m
+
     def elaborate(self, platform):
         m = Module()
 
+        if self.mode == "pipe":
+            return self.elaborate_pipe(m)
+
         # wait for all inputs valid before giving ready on both
 
         valid = Cat( [ s.valid for s in self.i ] )
@@ -380,13 +729,9 @@ class Join(Elaboratable):
 
         with m.If((valid == on) & (ready == on)):
             m.d.sync += self.o.valid.eq(1)
-            for idx in range(len(self.i)):
-                if self.fields[idx] == self.first_field:
-                    exclude = [ "valid", "ready" ] # get first/last from this stream
-                else:
-                    exclude = [ "valid", "ready", "first", "last" ]
-                m.d.sync += self.i[idx].ready.eq(0)
-                m.d.sync += Stream.connect(self.i[idx], self.o, exclude=exclude)
+            for s in self.i:
+                m.d.sync += s.ready.eq(0)
+            self.copy(m)
 
         with m.If(self.o.valid & self.o.ready):
             m.d.sync += self.o.valid.eq(0)
@@ -396,19 +741,51 @@ class Join(Elaboratable):
 #
 #   Split : takes input stream with multiple payloads, splits into N output streams,
 #   one for each payload.
+#
+#   depth=N : each output has its own StreamFifo of N words. The input is
+#   accepted, one word per clock, while all the fifos have space, so each
+#   output drains independently. Use N >= 2 for full rate;
+#   an output can then stall for up to N-2 clocks without stalling the input.
 
 class Split(Elaboratable):
 
-    def __init__(self, layout, name=None):
-        self.i = Stream(layout=layout, name=add_name(name, "in"))
+    def __init__(self, layout, name=None, depth=0):
+        from .fifo import StreamFifo
+        self.depth = depth
+        self.i = Stream(layout=layout, name=add_name(name, "in"), owner=self)
+        self.latency, self.ii = 1, (1 if depth else 3)
 
+        self.fifos = []
         for payload, width in layout:
-            s = Stream(layout=[ (payload, width), ], name=add_name(name, payload))
+            s = Stream(layout=[ (payload, width), ], name=add_name(name, payload), owner=self)
             setattr(self, payload, s)
+            if depth:
+                f = StreamFifo([ (payload, width), ], depth, name=add_name(name, f"fifo_{payload}"))
+                self.fifos += [ register(self, f, f"fifo_{payload}") ]
+
+    def elaborate_fifo(self, m):
+        m.submodules += self.fifos
+
+        # all the fifos have space
+        space = Signal()
+        m.d.comb += space.eq(Cat([ f.i.ready for f in self.fifos ]).all())
+        m.d.comb += self.i.ready.eq(space)
+
+        names = [ name for name, _ in self.i.get_layout() ]
+        for name, f in zip(names, self.fifos):
+            others = [ x for x in names if x != name ]
+            m.d.comb += Stream.connect(self.i, f.i, exclude=[ "valid", "ready", ] + others)
+            m.d.comb += f.i.valid.eq(self.i.valid & space)
+            m.d.comb += Stream.connect(f.o, getattr(self, name))
+
+        return m
 
     def elaborate(self, platform):
         m = Module()
 
+        if self.depth:
+            return self.elaborate_fifo(m)
+
         # Tx outputs
         for name, _ in self.i.get_layout():
             s = getattr(self, name)
@@ -442,17 +819,48 @@ class Split(Elaboratable):
 
 #
 #   Only enable i.ready when 'en'able is set.
+#
+#   registered=False : i is connected straight through to o,
+#   with valid/ready qualified by 'en'. No latency.
 
 class Gate(Elaboratable):
 
-    def __init__(self, layout=None, name=None):
-        self.i = Stream(layout=layout, name=add_name(name, "in"))
-        self.o = Stream(layout=layout, name=add_name(name, "out"))
+    def __init__(self, layout=None, name=None, mode=None, registered=True):
+        assert mode in [ None, "skid" ], ("unknown mode", mode)
+        assert registered or (mode is None), "mode needs registered=True"
+        self.mode = mode
+        self.registered = registered
+        self.i = Stream(layout=layout, name=add_name(name, "in"), owner=self)
+        self.o = Stream(layout=layout, name=add_name(name, "out"), owner=self)
         self.en = Signal(name=add_name(name, "en"))
+        if mode == "skid":
+            self.skid = register(self, SkidBuffer(layout, name=add_name(name, "skid")), "skid")
+        if registered:
+            self.latency, self.ii = 1, (1 if mode else 2)
+        else:
+            self.latency, self.ii = 0, 1
 
     def elaborate(self, platform):
         m = Module()
 
+        if not self.registered:
+            m.d.comb += Stream.connect(self.i, self.o, exclude=["valid", "ready"])
+            m.d.comb += [
+                self.o.valid.eq(self.i.valid & self.en),
+                self.i.ready.eq(self.o.ready & self.en),
+            ]
+            return m
+
+        if self.mode == "skid":
+            m.submodules += self.skid
+            m.d.comb += Stream.connect(self.i, self.skid.i, exclude=["valid", "ready"])
+            m.d.comb += [
+                self.skid.i.valid.eq(self.i.valid & self.en),
+                self.i.ready.eq(self.skid.i.ready & self.en),
+            ]
+            m.d.comb += Stream.connect(self.skid.o, self.o)
+            return m
+
         with m.If(self.o.valid & self.o.ready):
             m.d.sync += self.o.valid.eq(0)
 
@@ -469,20 +877,44 @@ class Gate(Elaboratable):
 #
 #   Allow a Packet through only when en is hi.
 #   Once the packet has started, allow it to complete.
+#
+#   registered=False : i is connected straight through to o. A packet
+#   may start when 'en' is hi with its 'first' word. No latency.
 
 class GatePacket(Elaboratable):
 
-    def __init__(self, layout=None, name=None):
-        self.i = Stream(layout=layout, name=add_name(name, "in"))
-        self.o = Stream(layout=layout, name=add_name(name, "out"))
+    def __init__(self, layout=None, name=None, registered=True):
+        self.registered = registered
+        self.latency, self.ii = (1, 2) if registered else (0, 1)
+        self.i = Stream(layout=layout, name=add_name(name, "in"), owner=self)
+        self.o = Stream(layout=layout, name=add_name(name, "out"), owner=self)
         self.en = Signal()
 
         self.allow = Signal()
         self.iready = Signal()
 
+    def elaborate_comb(self, m):
+        # pass this word : the packet has started, or starts now
+        gate = Signal()
+        m.d.comb += gate.eq(self.allow | (self.en & self.i.first))
+
+        m.d.comb += Stream.connect(self.i, self.o, exclude=["valid", "ready"])
+        m.d.comb += [
+            self.o.valid.eq(self.i.valid & gate),
+            self.i.ready.eq(self.o.ready & gate),
+        ]
+
+        with m.If(self.i.valid & self.i.ready):
+            m.d.sync += self.allow.eq(~self.i.last)
+
+        return m
+
     def elaborate(self, platform):
         m = Module()
 
+        if not self.registered:
+            return self.elaborate_comb(m)
+
         start = self.en & self.o.ready & self.i.first & self.i.valid & (~self.allow)
 
         m.d.comb += self.i.ready.eq(self.iready & self.allow)
@@ -514,37 +946,144 @@ class GatePacket(Elaboratable):
 
         return m
 
+#   Merge packets from N inputs onto one output.
 #
+#   policy=None : greedy, lowest numbered input first,
+#       one transfer every other clock.
+#   policy="round_robin" : the input after the last one served goes next.
+#   policy="weighted" : round robin, but input k may send up to
+#       weights[k] packets in a row.
 #
+#   The round robin policies use a registered one-hot grant and a
+#   registered output, sustaining one transfer per clock.
 
 class Arbiter(Elaboratable):
 
-    def __init__(self, layout=[], n=None, name="Arbiter"):
+    def __init__(self, layout=[], n=None, name="Arbiter", policy=None, weights=None):
         self.name = name
         assert n > 1
+        assert policy in [ None, "round_robin", "weighted" ], ("unknown policy", policy)
+        self.policy = policy
+        self.latency, self.ii = (1, 1) if policy else (3, 2)
         self.i = []
         self.s = []
         for i in range(n):
             label = f"i{i}"
-            s = Stream(layout=layout, name=label)
+            s = Stream(layout=layout, name=label, owner=self)
             self.i.append(s)
             setattr(self, label, s)
+            if policy:
+                continue
             label = f"s{i}"
-            s = Stream(layout=layout, name=label)
+            s = Stream(layout=layout, name=label, owner=self)
             self.s.append(s)
             setattr(self, label, s)
 
-        self.o = Stream(layout, "o")
+        self.o = Stream(layout, "o", owner=self)
+
+        if policy:
+            if policy == "weighted":
+                assert weights and (len(weights) == n), ("need a weight for each input", weights)
+                assert min(weights) >= 1, weights
+            self.weights = weights or ([ 1 ] * n)
+            self.grant = Signal(n)
+            # input served last, start with the top one so input 0 goes first
+            self.prev = Signal(n, reset=1 << (n-1))
+            self.locked = Signal()
+            self.credit = Signal(range(max(self.weights) + 1))
+        else:
+            self.next = Signal(n)
+            self.chan = Signal(n)
+            self.avail = Signal(n)
+
+    def elaborate_rr(self, m):
+        from .dot import draw
+
+        n = len(self.i)
+
+        ce = Signal()
+        m.d.comb += ce.eq(self.o.ready | ~self.o.valid)
+
+        valid = Signal(n)
+        m.d.comb += valid.eq(Cat([ s.valid for s in self.i ]))
 
-        self.next = Signal(n)
-        self.chan = Signal(n)
-        self.avail = Signal(n)
+        for k, s in enumerate(self.i):
+            m.d.comb += s.ready.eq(ce & self.grant[k])
+            draw(s, self.o)
+
+        xfer = Signal()
+        m.d.comb += xfer.eq((valid & self.grant).any() & ce)
+
+        # one-hot mux of the granted input
+        # payload plus first / last
+        width = self.o.layout.width + 2
+        data = Signal(width)
+        payload = 0
+        for k, s in enumerate(self.i):
+            payload = payload | Mux(self.grant[k], s.cat_payload(flags=True), 0)
+        m.d.comb += data.eq(payload)
+
+        # 'last' is the top bit of cat_payload(flags=True)
+        last = Signal()
+        m.d.comb += last.eq(data[-1])
+
+        # Tx output
+        with m.If(self.o.valid & self.o.ready):
+            m.d.sync += self.o.valid.eq(0)
+
+        with m.If(xfer):
+            m.d.sync += self.o.valid.eq(1)
+            m.d.sync += self.o.payload_eq(data, flags=True)
+
+        # Weights : allow the granted input another packet
+        weight = 0
+        for k, w in enumerate(self.weights):
+            weight = weight | Mux(self.grant[k], w, 0)
+        more = Signal()
+        m.d.comb += more.eq((self.credit + 1) < weight)
+
+        # start the next search after 'prev'
+        prev = Signal(n)
+        m.d.comb += prev.eq(self.prev)
+        with m.If(xfer):
+            m.d.comb += prev.eq(self.grant)
+            with m.If(last & more):
+                # the input below the granted one, so it is searched first
+                m.d.comb += prev.eq(Cat(self.grant[1:], self.grant[0]))
+                m.d.sync += self.credit.eq(self.credit + 1)
+            with m.Elif(last):
+                m.d.sync += self.credit.eq(0)
+            m.d.sync += self.prev.eq(prev)
+
+        # round robin search : (x & -x) selects the lowest bit
+        above = Signal(n)
+        m.d.comb += above.eq(valid & ~((prev << 1) - 1))
+        pick = Signal(n)
+        with m.If(above.any()):
+            m.d.comb += pick.eq(above & -above)
+        with m.Else():
+            m.d.comb += pick.eq(valid & -valid)
+
+        # hold the grant to the end of the packet
+        locked = Signal()
+        m.d.comb += locked.eq(Mux(xfer, ~last, self.locked))
+        m.d.sync += self.locked.eq(locked)
+
+        with m.If(~locked):
+            m.d.sync += self.grant.eq(pick)
+            with m.If(pick != self.grant):
+                m.d.sync += self.credit.eq(0)
+
+        return m
 
     def elaborate(self, platform):
         from .dot import draw
 
         m = Module()
 
+        if self.policy:
+            return self.elaborate_rr(m)
+
         for i in range(len(self.i)):
             draw(self.i[i], self.s[i])
             draw(self.s[i], self.o)
@@ -1,10 +1,24 @@
 #! /bin/env python3
 
+#   Run the tests/test_*.py modules, in parallel.
+#
+#   usage : test.py [--vcd] [--verbose] [-j N] [names ...]
+#
+#   names : only run modules whose name contains one of these, eg. "fifo"
+#   --vcd : write vcd files for every test. Otherwise vcd files are only
+#           written when a failing module is re-run.
+
 import sys
 import os
+import io
+import time
+import argparse
 import importlib
+import traceback
+import contextlib
+import multiprocessing
 
-# gtk subdirectory is used to save vcd and gtkwave config files
+# gtk subdirectory is used to save vcd and gtk files
 gtk = "gtk"
 if not os.path.exists(gtk):
     print("making subdir", gtk)
@@ -13,10 +27,14 @@ if not os.path.exists(gtk):
 dirname = "tests"
 
 sys.path.append(dirname)
+# streams/__init__.py does "import sim"
+sys.path.append("streams")
+
+from streams.stream import Connections
 
 def get_tests(dirname):
     names = []
-    for fname in os.listdir(dirname):
+    for fname in sorted(os.listdir(dirname)):
         if not fname.startswith("test_"):
             continue
         if not fname.endswith(".py"):
@@ -24,10 +42,60 @@ def get_tests(dirname):
         names.append(fname)
     return names
 
-for fname in get_tests(dirname):
-    name = dirname + "." + fname[:-3]
-    print("run", name)
-    m = importlib.import_module(name)
-    m.test(verbose=True)
+def run(args):
+    # run one test module, returns (name, ok, output, seconds)
+    name, verbose, vcd = args
+    if vcd:
+        os.environ["STREAMS_VCD"] = "1"
+    # some tests take a block name from argv
+    sys.argv = [ name ]
+    out = io.StringIO()
+    t = time.time()
+    ok = True
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            # each module records its connections in its own registry,
+            # so the pool's worker processes don't accumulate them
+            with Connections():
+                m = importlib.import_module(name)
+                m.test(verbose=verbose)
+        except BaseException:
+            traceback.print_exc()
+            ok = False
+    return name, ok, out.getvalue(), time.time() - t
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*")
+    parser.add_argument("--vcd", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    names = []
+    for fname in get_tests(dirname):
+        name = dirname + "." + fname[:-3]
+        if args.names and not any([ n in fname for n in args.names ]):
+            continue
+        names.append(name)
+
+    jobs = [ (name, args.verbose, args.vcd) for name in names ]
+    failed = []
+    with multiprocessing.Pool(max(1, args.jobs)) as pool:
+        for name, ok, output, t in pool.imap_unordered(run, jobs):
+            print("pass" if ok else "FAIL", name, f"{t:.1f}s")
+            if args.verbose or not ok:
+                print(output)
+            if not ok:
+                failed.append(name)
+
+    if failed and not args.vcd:
+        # re-run the failures to get the vcd files
+        print("re-running with vcd :", " ".join(failed))
+        with multiprocessing.Pool(max(1, args.jobs)) as pool:
+            pool.map(run, [ (name, False, True) for name in failed ])
+
+    print(len(names) - len(failed), "passed,", len(failed), "failed")
+    sys.exit(1 if failed else 0)
 
 #   FIN
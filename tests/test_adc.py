@@ -2,7 +2,7 @@
 
 from amaranth.sim import *
 
-from streams.sim import SourceSim, SinkSim
+from streams.sim import SourceSim, SinkSim, write_vcd
 from streams.adc import MAX11125
 
 #
@@ -69,7 +69,7 @@ def sim(verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/max11125.vcd", traces=m.ports()):
+    with write_vcd(sim, "gtk/max11125.vcd", traces=m.ports()):
         sim.run()
 
 #
@@ -2,7 +2,7 @@
 from amaranth.sim import *
 
 from streams import to_packet
-from streams.sim import SourceSim, SinkSim
+from streams.sim import SourceSim, SinkSim, write_vcd
 from streams.dac import AD56x8
 from streams.spi import SpiIo, SpiClock
 
@@ -68,7 +68,7 @@ def sim_dac(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/ulx3s_dac.vcd", traces=m.ports()):
+    with write_vcd(sim, "gtk/ulx3s_dac.vcd", traces=m.ports()):
         sim.run()
 
 #
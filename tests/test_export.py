@@ -0,0 +1,253 @@
+#!/bin/env python3
+
+import os
+import json
+import warnings
+import random
+import xml.etree.ElementTree as ET
+
+from amaranth import *
+from amaranth.hdl import Fragment
+
+import sys
+spath = "../streams"
+if not spath in sys.path:
+    sys.path.append(spath)
+# bench.py is in the top directory
+if not ".." in sys.path:
+    sys.path.append("..")
+
+from streams.stream import Stream, Copy, Tee, Join, Connections
+from streams import dot
+from streams.export import Graph, get_timing
+
+# the same Pipeline that test_profiler profiles
+from test_profiler import Pipeline
+
+#
+#   A buffered Tee, with a slow stage on one output only
+
+class Branch(Elaboratable):
+
+    def __init__(self, layout):
+        self.name = "Branch"
+        self.i = Stream(layout=layout, name="i")
+        self.tee = Tee(2, layout, depth=4)
+        self.fast = Copy(layout, mode="skid")
+        self.slow = Copy(layout)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += [ self.tee, self.fast, self.slow, ]
+
+        m.d.comb += Stream.connect(self.i, self.tee.i)
+        m.d.comb += Stream.connect(self.tee.o[0], self.fast.i)
+        m.d.comb += Stream.connect(self.tee.o[1], self.slow.i)
+
+        return m
+
+#
+#   A chain of full rate Tee / Join diamonds, with a slow stage on a side
+#   branch : 2**n paths from input to output
+
+class Diamonds(Elaboratable):
+
+    def __init__(self, n):
+        self.name = "Diamonds"
+        layout = [ ("a", 16) ]
+        self.i = Stream(layout=layout, name="i")
+        self.side = Tee(2, layout, depth=4)
+        self.slow = Copy(layout)
+        self.tees = [ Tee(2, layout, depth=4) for _ in range(n) ]
+        self.joins = [ Join(a=[("a", 16)], b=[("b", 16)], mode="pipe") for _ in range(n) ]
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += [ self.side, self.slow, ] + self.tees + self.joins
+
+        m.d.comb += Stream.connect(self.i, self.side.i)
+        m.d.comb += Stream.connect(self.side.o[1], self.slow.i)
+        s = self.side.o[0]
+        for tee, join in zip(self.tees, self.joins):
+            m.d.comb += Stream.connect(s, tee.i, exclude=["b"])
+            m.d.comb += Stream.connect(tee.o[0], join.i[0])
+            m.d.comb += Stream.connect(tee.o[1], join.i[1], mapping={"a":"b"})
+            s = join.o
+
+        return m
+
+def get_graph(m):
+    with Connections() as c:
+        Fragment.get(m, None)
+    return Graph(m, connections=c)
+
+#
+#
+
+def check_pipeline(verbose):
+    print("test pipeline throughput")
+    m = Pipeline([ ("data", 16) ])
+    g = get_graph(m)
+    if verbose:
+        g.print_throughput()
+
+    r = g.throughput()
+    assert len(r) == 1, r
+    d = r[0]
+    assert d["path"][0] == "Pipeline.i", d
+    assert d["path"][-1] == "Pipeline.o", d
+    # the legacy Copy takes a word every 3 clocks
+    assert d["rate"] == 1 / 3, d
+    assert d["limit"] == "Pipeline.slow", d
+    # a.skid, b.skid, slow, c.skid : each Copy(skid) is counted once
+    assert d["latency"] == 4, d
+    assert not d["undeclared"], d
+    assert g.bottleneck() == "Pipeline.slow"
+
+def check_branch(verbose):
+    print("test branch throughput")
+    m = Branch([ ("data", 16) ])
+    g = get_graph(m)
+    if verbose:
+        g.print_throughput()
+
+    r = g.throughput()
+    assert len(r) == 2, r
+    ends = [ (d["path"][-1], d["rate"], d["limit"]) for d in r ]
+    # slowest first
+    assert ends[0] == ("Branch.slow.out", 1 / 3, "Branch.slow"), ends
+    assert ends[1] == ("Branch.fast.out", 1, None), ends
+    assert g.bottleneck() == "Branch.slow"
+
+def check_diamonds(verbose):
+    print("test diamonds throughput")
+    m = Diamonds(14)
+    g = get_graph(m)
+    if verbose:
+        g.print_throughput()
+
+    r = g.throughput()
+    # one entry for each sink : the slow branch, and the end of the chain
+    assert len(r) == 2, r
+    d = r[0]
+    assert d["rate"] == 1 / 3, d
+    assert d["limit"] == "Diamonds.slow", d
+    assert d["path"][-1] == "Diamonds.slow.out", d
+    d = r[1]
+    assert d["rate"] == 1, d
+    # each Tee and Join(pipe) adds a clock
+    assert d["latency"] == 1 + (14 * 2), d
+    assert g.bottleneck() == "Diamonds.slow"
+
+def check_export(verbose):
+    print("test export")
+    m = Pipeline([ ("data", 16), ("x", 4), ])
+    g = get_graph(m)
+
+    os.makedirs("gtk", exist_ok=True)
+    path = "gtk/export.json"
+    g.write_json(path)
+    d = json.load(open(path))
+    blocks = dict([ (b["path"], b) for b in d["blocks"] ])
+    assert blocks["Pipeline.slow"]["ii"] == 3, blocks
+    assert blocks["Pipeline.a.skid"]["latency"] == 1, blocks
+    assert blocks["Pipeline"]["ii"] is None, blocks
+    streams = dict([ (s["path"], s) for s in d["streams"] ])
+    assert streams["Pipeline.i"]["width"] == 20, streams
+    assert streams["Pipeline.i"]["layout"] == [ [ "data", 16 ], [ "x", 4 ] ], streams
+    assert len(d["connections"]) == len(g.edges), d["connections"]
+    assert d["throughput"][0]["limit"] == "Pipeline.slow"
+
+    path = "gtk/export.graphml"
+    g.write_graphml(path)
+    ns = { "g" : "http://graphml.graphdrawing.org/xmlns" }
+    root = ET.parse(path).getroot()
+    nodes = root.findall("g:graph/g:node", ns)
+    edges = root.findall("g:graph/g:edge", ns)
+    assert len(nodes) == len(g.blocks) + len(g.streams), len(nodes)
+    # an 'owns' edge for every stream, and the connections
+    assert len(edges) == len(g.streams) + len(g.edges), len(edges)
+
+#
+#   A block that registers only some of its Streams : dot only draws those
+
+class Partial(Elaboratable):
+
+    def __init__(self, layout):
+        self.i = Stream(layout=layout, name="i", owner=self)
+        self.o = Stream(layout=layout, name="o")
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.comb += Stream.connect(self.i, self.o)
+        return m
+
+def check_members(verbose):
+    print("test registered members")
+    layout = [ ("data", 16) ]
+    m = Tee(3, layout)
+    names = [ name for name, _ in dot.get_members(m) ]
+    assert names == [ "in", "out[0]", "out[1]", "out[2]" ], names
+
+    m = Partial(layout)
+    # only the registered Stream is drawn
+    names = [ name for name, _ in dot.get_members(m) ]
+    assert names == [ "i" ], names
+    # the opt-in check finds the other
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        missed = dot.check_registry(m, dot.get_registry(m))
+    assert missed == [ "o" ], missed
+    assert "unregistered Streams" in str(w[0].message), w
+
+    # the library blocks register all their Streams
+    for m in [ Copy(layout, mode="skid"), Tee(3, layout), Join(a=[("a", 8)], b=[("b", 8)]), ]:
+        assert dot.get_registry(m) is not None, m
+        assert not dot.check_registry(m, dot.get_registry(m)), m
+
+#
+#   Check each block's declared ii against bench.py's saturated run.
+#   The rate is 1 / the most common number of clocks between accepted words :
+#   eg. a legacy Sum takes a word every 2 clocks, but 'last' costs one more,
+#   so its mean over the run is a little lower.
+
+def check_timing(verbose, cycles=200):
+    print("test declared timing")
+    import bench
+    for label, fn, kwargs in bench.benchmarks:
+        try:
+            dut, inputs, outputs, setup, extra = fn(**kwargs)
+        except bench.Skip:
+            continue
+        _, ii = get_timing(dut)
+        if ii is None:
+            continue
+        rng = random.Random(1)
+        words = [ bench.Words(s, rng, **extra) for s in inputs ]
+        r = bench.run(dut, label, "sat", inputs, outputs, words, cycles=cycles, setup=setup)
+
+        measured = r.ii()
+        mean = len(r.accepts) / cycles
+        if verbose:
+            print(f"{label:28s} ii {ii} rate {1 / measured:.3f} mean {mean:.3f}")
+        assert (1 / measured) == (1 / ii), (label, ii, measured)
+        assert mean <= ((1 / ii) + (1 / cycles)), (label, ii, mean)
+
+#
+#
+
+def test(verbose):
+    check_pipeline(verbose)
+    check_branch(verbose)
+    check_diamonds(verbose)
+    check_export(verbose)
+    check_members(verbose)
+    check_timing(verbose)
+
+#
+#
+
+if __name__ == "__main__":
+    test(True)
+
+#   FIN
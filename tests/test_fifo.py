@@ -0,0 +1,236 @@
+#!/bin/env python3
+
+from amaranth import *
+from amaranth.sim import *
+
+import sys
+spath = "../streams"
+if not spath in sys.path:
+    sys.path.append(spath)
+
+from streams.stream import to_packet
+from streams.sim import SourceSim, SinkSim, write_vcd, sim_rate
+from streams.fifo import StreamFifo, AsyncStreamFifo, PacketFifo
+
+#
+#
+
+def sim_fifo(m, verbose):
+    print("test fifo", m.depth)
+    sim = Simulator(m)
+
+    src = SourceSim(m.i, verbose=verbose)
+    sink = SinkSim(m.o)
+
+    def tick(n=1):
+        assert n
+        for i in range(n):
+            yield Tick()
+            yield from src.poll()
+            yield from sink.poll()
+
+    def proc():
+        data = [
+            [ 1, 2, 3, 4, ],
+            [ 100, ],
+            [ 5, 6, 7, ],
+        ]
+        for p in data:
+            for x in to_packet(p):
+                src.push(10, **x)
+
+        n = sum([ len(p) for p in data ])
+
+        # hold off the reader : the fifo should absorb the burst
+        sink.read_data = False
+        yield from tick(60)
+        assert src.done()
+        level = yield m.level
+        assert level == n, (level, n)
+        af = yield m.almost_full
+        ae = yield m.almost_empty
+        assert (af, ae) == (1, 0), (af, ae)
+
+        sink.read_data = True
+        yield from tick(40)
+        level = yield m.level
+        assert level == 0, level
+        ae = yield m.almost_empty
+        assert ae == 1
+
+        assert sink.get_data("data") == data, sink.get_data("data")
+
+    sim.add_clock(1 / 100e6)
+    sim.add_process(proc)
+    with write_vcd(sim, "gtk/fifo.vcd", traces=[]):
+        sim.run()
+
+#
+#   sim_rate() drives the handshake directly : check one word per clock
+
+def check_rate(m, verbose):
+    print("test fifo rate")
+    data = list(range(1, 50))
+
+    words = [ { "data" : x } for x in data ]
+    rx, t = sim_rate(m, words, limit=200, vcd="gtk/fifo_rate.vcd")
+
+    if verbose:
+        print("rate", len(data), "words in", t, "clocks")
+    assert [ d["data"] for d in rx ] == data, rx
+    assert t <= (len(data) + 3), t
+
+#
+#   Slow write domain feeding a fast read domain, and vice versa
+
+def sim_async(dut, w_period, r_period, verbose):
+    print("test async fifo", w_period, r_period)
+    m = Module()
+    m.domains.wr = ClockDomain("wr")
+    m.domains.rd = ClockDomain("rd")
+    m.submodules.dut = dut
+    sim = Simulator(m)
+
+    src = SourceSim(dut.i, verbose=verbose)
+    sink = SinkSim(dut.o)
+
+    data = [
+        [ 1, 2, 3, 4, ],
+        [ 100, ],
+        [ 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, ],
+    ]
+    for p in data:
+        for x in to_packet(p):
+            src.push(0, **x)
+
+    def writer():
+        while True:
+            yield Tick("wr")
+            # wait for the last word to be accepted
+            valid = yield dut.i.valid
+            if src.done() and not valid:
+                break
+            yield from src.poll()
+
+    def reader():
+        n = sum([ len(p) for p in data ])
+        while sum([ len(p) for p in sink.get_data() ]) < n:
+            yield Tick("rd")
+            yield from sink.poll()
+        for i in range(10):
+            yield Tick("rd")
+            yield from sink.poll()
+        assert sink.get_data("data") == data, sink.get_data("data")
+
+    sim.add_clock(w_period, domain="wr")
+    sim.add_clock(r_period, domain="rd")
+    sim.add_process(writer)
+    sim.add_process(reader)
+    with write_vcd(sim, "gtk/fifo_async.vcd", traces=[]):
+        sim.run()
+
+#
+#
+
+def sim_packet(m, verbose):
+    print("test packet fifo")
+    sim = Simulator(m)
+
+    # (packet, abort on word n)
+    data = [
+        ( [ 1, 2, 3, 4, ], None, ),
+        ( [ 5, 6, 7, ], 1, ),
+        ( [ 8, ], None, ),
+        ( [ 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, ], None ), # too big for the buffer
+        ( [ 19, 20, 21, ], 2, ),
+        ( [ 22, 23, 24, 25, 26, 27, 28, 29, ], None, ),
+    ]
+
+    words = []
+    for p, abort in data:
+        for i, x in enumerate(to_packet(p)):
+            words.append((x, i == abort))
+    # a packet with no 'last', restarted by the next 'first'
+    words.insert(4, ({ "data" : 100, "first" : 1, "last" : 0 }, False))
+
+    expect = [ p for p, abort in data if (abort is None) and (len(p) <= m.depth) ]
+
+    def proc():
+        rx = []
+        tx = 0
+        t = 0
+        times = []
+        dropped = 0
+        while (t < 300):
+            if tx < len(words):
+                d, abort = words[tx]
+                yield m.i.valid.eq(1)
+                yield m.i.data.eq(d["data"])
+                yield m.i.first.eq(d["first"])
+                yield m.i.last.eq(d["last"])
+                yield m.abort.eq(abort)
+            else:
+                yield m.i.valid.eq(0)
+                yield m.abort.eq(0)
+            # hold off the reader while the big packet fills the buffer
+            yield m.o.ready.eq(not (50 < t < 100))
+
+            i_rdy = yield m.i.ready
+            i_valid = yield m.i.valid
+            o_valid = yield m.o.valid
+            o_rdy = yield m.o.ready
+            if o_valid & o_rdy:
+                d = yield m.o.data
+                first = yield m.o.first
+                if first:
+                    rx.append([])
+                    times.append([])
+                rx[-1].append(d)
+                times[-1].append(t)
+            if i_rdy & i_valid:
+                tx += 1
+            dropped += yield m.dropped
+
+            yield Tick()
+            t += 1
+
+        assert rx == expect, (rx, expect)
+        assert dropped == 4, dropped
+        # each packet leaves as a burst, one word per clock
+        for tt in times:
+            assert tt == list(range(tt[0], tt[0] + len(tt))), tt
+
+    sim.add_clock(1 / 100e6)
+    sim.add_testbench(proc)
+    with write_vcd(sim, "gtk/fifo_packet.vcd", traces=[]):
+        sim.run()
+
+#
+#
+
+def test(verbose):
+    layout = [ ("data", 16), ]
+
+    for use_bram in [ False, True ]:
+        dut = StreamFifo(layout, 8, use_bram=use_bram, af_level=6)
+        sim_fifo(dut, verbose)
+
+        dut = StreamFifo(layout, 4, use_bram=use_bram)
+        check_rate(dut, verbose)
+
+        dut = AsyncStreamFifo(layout, 8, r_domain="rd", w_domain="wr", use_bram=use_bram)
+        sim_async(dut, 1 / 10e6, 1 / 100e6, verbose)
+
+        dut = AsyncStreamFifo(layout, 8, r_domain="rd", w_domain="wr", use_bram=use_bram)
+        sim_async(dut, 1 / 100e6, 1 / 33e6, verbose)
+
+    dut = PacketFifo(layout, 8)
+    sim_packet(dut, verbose)
+
+#
+#
+
+if __name__ == "__main__":
+    test(False)
+
+#   FIN
@@ -9,7 +9,7 @@ if not "." in sys.path:
 from amaranth import *
 from amaranth.sim import *
 
-from streams.sim import SinkSim, SourceSim
+from streams.sim import SinkSim, SourceSim, write_vcd
 from streams.i2s import I2SOutput, I2SInput, I2STxClock, I2SRxClock, I2SInputLR
 
 def load_lr_data(s, t, lr):
@@ -59,7 +59,7 @@ def sim_o(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/i2s.vcd"):
+    with write_vcd(sim, "gtk/i2s.vcd"):
         sim.run()
 
 #
@@ -133,7 +133,7 @@ def sim_i(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/i2s_i.vcd"):
+    with write_vcd(sim, "gtk/i2s_i.vcd"):
         sim.run()
 
 #
@@ -186,7 +186,7 @@ def sim_tx_ck(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/i2s_ck.vcd"):
+    with write_vcd(sim, "gtk/i2s_ck.vcd"):
         sim.run()
 
 #
@@ -226,7 +226,7 @@ def sim_rx_ck(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/i2s_rx_ck.vcd", traces=[]):
+    with write_vcd(sim, "gtk/i2s_rx_ck.vcd", traces=[]):
         sim.run()
 
 #
@@ -348,7 +348,7 @@ def sim_lr_tx(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/i2s_lr_tx.vcd", traces=[]):
+    with write_vcd(sim, "gtk/i2s_lr_tx.vcd", traces=[]):
         sim.run()
 
 #
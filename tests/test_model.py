@@ -0,0 +1,147 @@
+#!/bin/env python3
+
+import random
+
+from amaranth import *
+from amaranth.sim import *
+
+import sys
+spath = "../streams"
+if not spath in sys.path:
+    sys.path.append(spath)
+
+from streams.ops import Sum, Enumerate
+from streams.sim import BulkSourceSim, BulkSinkSim, write_vcd
+from streams import model
+
+#
+#   Check the models against the expected results in test_ops / test_route
+
+def check_models():
+    print("test models")
+    to_lists = model.to_lists
+
+    data = [
+        [ 1, 2, 3, 4, ],
+        [ 100, ],
+        [ 0, ],
+        [ -1, ],
+        [ -1, 1, ],
+        [ 1, 2, 4, 8, 16, 32, 64, ],
+        [ -1, -2, -4, -8, -16, -32, -64, ],
+    ]
+    s = model.sum_packets(data, 16, 32)
+    assert list(s) == [ sum([ x & 0xffff for x in p ]) for p in data ], s
+    s = model.sum_signed_packets(data, 16, 32)
+    assert list(s) == [ sum(p) & 0xffffffff for p in data ], s
+
+    a = model.abs_values(sum(data, []), 16)
+    assert list(a) == [ abs(x) for x in sum(data, []) ], a
+
+    m = model.max_values([ 0, 1, 10, 100, 1000 ], [ 1, 3, 5, 50, 2000 ], 16, 16)
+    assert list(m) == [ 1, 3, 10, 100, 2000 ], m
+    m = model.max_values([ -1, 5 ], [ 1, -5 ], 16, 16)
+    assert list(m) == [ 1, 5 ], m
+
+    d = model.delta([
+        [ 0, 0, 1, 100, 100, 100, 100, 10, 10, ],
+        [ 0, 0, 1, 100, 100, 100, 100, 10, ],
+        [ -1, -2, -1, 0, 0, 0, 0, 0, 10, ],
+    ], 16)
+    expect = [ 1, 100, 10, 0, 1, 100, 10, -1, -2, -1, 0, 10 ]
+    assert list(d) == [ x & 0xffff for x in expect ], d
+
+    d = model.decimate(list(range(100)), 4)
+    assert list(d) == list(range(0, 100, 4)), d
+
+    e = model.enumerate_packets([ [ 1, 2, 3, 4 ], [ 100 ], [ 0, 1, 2, 3, 10 ] ], offset=3)
+    assert to_lists(e) == [ [ 3, 4, 5, 6 ], [ 3 ], [ 3, 4, 5, 6, 7 ] ], e
+
+    idx, state = model.bit_state([ 0, 5, 15 ], 16)
+    assert idx.tolist() == [ [ 0, 1, 2, 3 ] ] * 3, idx
+    assert state.tolist() == [ [ 0, 0, 0, 0 ], [ 1, 0, 1, 0 ], [ 1, 1, 1, 1 ] ], state
+
+    p = model.mux_down([ [ 0x12345678, 0x11223344 ], [ 1 ], [ 0xffffffff ] ], 32, 8)
+    assert to_lists(p) == [
+        [ 0x78, 0x56, 0x34, 0x12, 0x44, 0x33, 0x22, 0x11, ],
+        [ 1, 0, 0, 0, ],
+        [ 0xff, 0xff, 0xff, 0xff, ],
+    ], p
+
+    p = model.mux_up([
+        [ 1, 2, 3, 4 ],
+        [ 0 ],
+        [ 0xffffffff ],
+        [ 0x12, 0x23, 0x34 ],
+        [ 0x11, 0x22, 0x33, 0x44, 0x55 ],
+    ], 8, 16)
+    assert to_lists(p) == [
+        [ 0x0102, 0x0304, ],
+        [ 0 ],
+        [ 0xff ],
+        [ 0x1223, 0x34 ],
+        [ 0x1122, 0x3344, 0x55 ],
+    ], p
+
+    all_data = [ 1, 2, 3, 4, 3, 4, 5, 1, 0, 1, 16, 4, 5, 6, 7, 8 ]
+    for n in [ 4, 1, 8, 3 ]:
+        p = model.packetise(all_data, n)
+        assert to_lists(p) == [ all_data[i:i+n] for i in range(0, len(all_data), n) ], p
+
+#
+#   Random packets through the hardware, checked against the model
+
+def sim_random(m, packets, check, verbose):
+    print("test model", m.__class__.__name__)
+    sim = Simulator(m)
+
+    src = BulkSourceSim(m.i, packets)
+    sink = BulkSinkSim(m.o)
+
+    def proc():
+        while not src.done():
+            yield Tick()
+            yield from src.poll()
+            yield from sink.poll()
+        for i in range(10):
+            yield Tick()
+            yield from src.poll()
+            yield from sink.poll()
+
+        check(sink)
+
+    sim.add_clock(1 / 100e6)
+    sim.add_process(proc)
+    with write_vcd(sim, "gtk/model.vcd", traces=[]):
+        sim.run()
+
+#
+#
+
+def test(verbose):
+    check_models()
+
+    rng = random.Random(1)
+    packets = [ [ rng.getrandbits(16) for i in range(rng.randint(1, 20)) ] for j in range(40) ]
+
+    def check_sum(sink):
+        r = sum(sink.get_data("data"), [])
+        assert r == list(model.sum_packets(packets, 16, 32)), r
+
+    dut = Sum(16, 32, mode="pipe")
+    sim_random(dut, packets, check_sum, verbose)
+
+    def check_enum(sink):
+        assert sink.get_data("data") == packets
+        assert sink.get_data("idx") == model.to_lists(model.enumerate_packets(packets, offset=5)), sink.get_data("idx")
+
+    dut = Enumerate(layout=[("data", 16)], idx=[("idx", 8)], offset=5, mode="pipe")
+    sim_random(dut, packets, check_enum, verbose)
+
+#
+#
+
+if __name__ == "__main__":
+    test(False)
+
+#   FIN
@@ -8,8 +8,10 @@ from amaranth.sim import *
 sys.path.append(".")
 sys.path.append("streams/streams")
 
-from streams.sim import SinkSim, SourceSim
-from streams.monitor import MonitorText, Tap
+from streams.sim import SinkSim, SourceSim, write_vcd
+from streams.monitor import MonitorText, Tap, StreamCounters, Monitor
+from streams.stream import Stream, Tee, Connections
+from streams import dot
 
 #
 #
@@ -63,7 +65,7 @@ def sim_tap(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/tap.vcd", traces=[]):
+    with write_vcd(sim, "gtk/tap.vcd", traces=[]):
         sim.run()
 
 #
@@ -115,12 +117,127 @@ def sim_monitor_text(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/monitor_text.vcd", traces=[]):
+    with write_vcd(sim, "gtk/monitor_text.vcd", traces=[]):
         sim.run()
 
 #
 #
 
+def sim_counters(m, verbose):
+    print("test counters")
+    top = Module()
+    top.submodules.counters = m
+    s = Stream(layout=[("data", 8)], name="s")
+    top.d.comb += m.tap(s)
+    sim = Simulator(top)
+
+    import random
+    rng = random.Random(1)
+
+    def proc():
+        yield m.o.ready.eq(1)
+        expect = dict([ (f, 0) for f in m.fields ])
+
+        def read(clear=0):
+            yield s.valid.eq(0)
+            yield s.ready.eq(0)
+            yield m.ci.valid.eq(1)
+            yield m.ci.clear.eq(clear)
+            while True:
+                r = yield m.ci.ready
+                yield Tick()
+                expect["cycles"] += 1
+                if r:
+                    break
+            yield m.ci.valid.eq(0)
+            while not (yield m.o.valid):
+                yield Tick()
+            d = {}
+            for f in m.fields:
+                d[f] = yield getattr(m.o, f)
+            return d
+
+        for t in range(500):
+            v = rng.random() < 0.6
+            r = rng.random() < 0.5
+            l = rng.random() < 0.2
+            yield s.valid.eq(v)
+            yield s.ready.eq(r)
+            yield s.last.eq(l)
+            expect["cycles"] += 1
+            expect["transfers"] += v and r
+            expect["stalls"] += v and not r
+            expect["starved"] += r and not v
+            expect["packets"] += v and r and l
+            yield Tick()
+
+        # the snapshot is taken on the clock the request is accepted
+        expect["cycles"] -= 1
+        d = yield from read(clear=1)
+        if verbose:
+            print(d)
+        assert d == expect, (d, expect)
+
+        # after a clear
+        d = yield from read()
+        assert d["transfers"] == 0, d
+        assert d["cycles"] < 5, d
+
+    sim.add_clock(1 / 50e6)
+    sim.add_testbench(proc)
+    with write_vcd(sim, "gtk/counters.vcd", traces=[]):
+        sim.run()
+
+#
+#   A 64 channel Monitor, fed by Tees held in a list
+
+class Channels(Elaboratable):
+
+    def __init__(self, layout, n):
+        self.tees = [ Tee(2, layout, name=f"ch{i}") for i in range(n) ]
+        self.mon = Monitor(layout, n)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += self.tees + [ self.mon ]
+        for i, t in enumerate(self.tees):
+            m.d.comb += Stream.connect(t.o[0], self.mon.i[i])
+        return m
+
+def check_graph(verbose, n=64):
+    print("test graph")
+    import io, time
+    from amaranth.hdl import Fragment
+
+    dut = Channels([ ("data", 16) ], n)
+    with Connections() as c:
+        Fragment.get(dut, None)
+
+    t = time.perf_counter()
+    cluster = dot.get_clusters(dut)
+    f = io.StringIO()
+    cluster.print_dot(f, connections=c)
+    t = time.perf_counter() - t
+    if verbose:
+        print(f"graph of {n} channels in {t*1e3:.1f}ms")
+
+    # every stream : each Tee's in and 2 outs, the Monitor's n inputs and o0, o1, ci
+    streams = cluster.all_streams()
+    assert len(streams) == len(set([ id(s) for s in streams ])) == (3 * n) + n + 3, len(streams)
+    text = f.getvalue()
+    for tee in dut.tees:
+        for s in [ tee.i ] + tee.o:
+            assert f"{id(s)} [shape=box" in text, s
+    # every connection, including those inside the Tees
+    assert text.count(" -> ") == len(c), (text.count(" -> "), len(c))
+    for tee, s in zip(dut.tees, dut.mon.i):
+        assert f"{id(tee.o[0])} -> {id(s)} " in text, s
+    assert t < 0.5, t
+    return dut
+
+#
+#
+
 def test(verbose):
     if len(sys.argv) > 1:
         test_all = False
@@ -129,6 +246,13 @@ def test(verbose):
         test_all = True
         name = ""
 
+    if test_all or (name == "StreamCounters"):
+        dut = StreamCounters(width=16)
+        sim_counters(dut, verbose)
+
+    if test_all or (name == "graph"):
+        dut = check_graph(verbose)
+
     if test_all:
         dut = MonitorText(layout=[("abc", 32), ("data", 6), ("test", 12)])
         sim_monitor_text(dut)
@@ -137,7 +261,6 @@ def test(verbose):
         dut = Tap(layout=[("abc", 32), ("data", 6), ("test", 12)])
         sim_tap(dut)
 
-    from streams import dot
     dot_path = "/tmp/test.dot"
     png_path = "test.png"
     dot.graph(dut, dot_path, png_path)
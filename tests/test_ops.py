@@ -9,7 +9,7 @@ if not spath in sys.path:
     sys.path.append(spath)
 
 from streams.stream import Stream
-from streams.sim import SourceSim, SinkSim
+from streams.sim import SourceSim, SinkSim, write_vcd, sim_rate
 
 from streams.ops import *
 
@@ -36,6 +36,8 @@ def sim_ops(m, check, vcd, verbose):
             [   (0, 0), (0, 1), (1, 0,), (1, 1), ],
             [   (1, -1,), (-1, 1), (-1, -1), ],
             [   (10, 1,), (16, 3), (200, 10), (13, 7), ],
+            # full scale, for the partial products of the staged Mul
+            [   (32767, 32767), (-32768, -32768), (-32768, 32767), (-12345, 23456), ],
         ]
 
         for p in data:
@@ -44,13 +46,13 @@ def sim_ops(m, check, vcd, verbose):
                 last = i == (len(p) - 1)
                 src.push(10, a=a, b=b, first=first, last=last)
 
-        yield from tick(50)
+        yield from tick(80)
 
         check(data, sink.get_data("data"))
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/" + vcd, traces=m.ports()):
+    with write_vcd(sim, "gtk/" + vcd, traces=m.ports()):
         sim.run()
 
 #
@@ -127,7 +129,7 @@ def sim_sum(m, check, vcd, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/" + vcd, traces=m.ports()):
+    with write_vcd(sim, "gtk/" + vcd, traces=m.ports()):
         sim.run()
 
 def check_sum(data, result):
@@ -174,7 +176,7 @@ def sim_unary(m, fn, verbose, title, vcd, data):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/" + vcd):
+    with write_vcd(sim, "gtk/" + vcd):
         sim.run()
 
 #
@@ -268,7 +270,7 @@ def sim_const(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/const.vcd"):
+    with write_vcd(sim, "gtk/const.vcd"):
         sim.run()
 
 #
@@ -325,7 +327,7 @@ def sim_bit_change(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/bit_change.vcd"):
+    with write_vcd(sim, "gtk/bit_change.vcd"):
         sim.run()
 
 #
@@ -367,7 +369,7 @@ def sim_decimate(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/decimate.vcd"):
+    with write_vcd(sim, "gtk/decimate.vcd"):
         sim.run()
 
 #
@@ -405,7 +407,7 @@ def sim_max(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/max.vcd"):
+    with write_vcd(sim, "gtk/max.vcd"):
         sim.run()
 
 #
@@ -462,9 +464,25 @@ def sim_enum(m, verbose):
 
     sim.add_clock(1 / 50e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/enum.vcd", traces=[]):
+    with write_vcd(sim, "gtk/enum.vcd", traces=[]):
         sim.run()
 
+#
+#   sim_rate() drives the handshake directly : check one word per clock
+
+def check_rate(m, verbose, latency=1):
+    print("test rate", m.__class__.__name__, m.mode, m.stages)
+    a = list(range(1, 40))
+    b = list([ (i * 3) for i in a ])
+
+    words = [ { "a" : x, "b" : y } for x, y in zip(a, b) ]
+    rx, t = sim_rate(m, words, limit=200, vcd="gtk/ops_rate.vcd")
+
+    if verbose:
+        print("rate", len(a), "words in", t, "clocks")
+    assert [ d["data"] for d in rx ] == [ (x * y) for x, y in zip(a, b) ], rx
+    assert t <= (len(a) + latency + 1), t
+
 #
 #
 
@@ -514,6 +532,45 @@ def test(verbose):
     dut = Enumerate(layout=layout, idx=[("addr", 8)], offset=3)
     sim_enum(dut, verbose)
 
+    # pipelined versions of the ops
+    mode = "pipe"
+
+    dut = Mul(16, 32, mode=mode)
+    sim_ops(dut, check_mul, "ops_mul_pipe.vcd", verbose)
+    check_rate(Mul(16, 32, mode=mode), verbose)
+
+    # multi-stage multipliers
+    dut = Mul(16, 32, stages=3)
+    sim_ops(dut, check_mul, "ops_mul_3.vcd", verbose)
+    check_rate(Mul(16, 32, stages=3), verbose, latency=3)
+
+    dut = MulSigned(16, 32, stages=4)
+    sim_ops(dut, check_mul_signed, "ops_muls_4.vcd", verbose)
+
+    dut = MulSigned(16, 32, stages=5)
+    sim_ops(dut, check_mul_signed, "ops_muls_5.vcd", verbose)
+
+    dut = AddSigned(16, 32, mode=mode)
+    sim_ops(dut, check_add_signed, "ops_adds_pipe.vcd", verbose)
+
+    dut = SumSigned(16, 32, mode=mode)
+    sim_sum(dut, check_sum_signed, "ops_sums_pipe.vcd", verbose)
+
+    dut = Abs(layout=[("data", 16)], mode=mode)
+    sim_abs(dut, verbose)
+
+    dut = Delta(layout=[("data", 16)], fields=["data"], mode=mode)
+    sim_delta(dut, verbose)
+
+    dut = Decimate(4, layout=[("a", 16), ("b", 8)], mode=mode)
+    sim_decimate(dut, verbose)
+
+    dut = Max(16, 16, mode=mode)
+    sim_max(dut, verbose)
+
+    dut = Enumerate(layout=layout, idx=[("addr", 8)], offset=3, mode=mode)
+    sim_enum(dut, verbose)
+
 #
 #
 
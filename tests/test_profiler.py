@@ -0,0 +1,135 @@
+#!/bin/env python3
+
+from amaranth import *
+from amaranth.sim import *
+from amaranth.hdl import Fragment
+
+import os
+import gc
+import sys
+spath = "../streams"
+if not spath in sys.path:
+    sys.path.append(spath)
+
+from streams.stream import Stream, Copy, Connections
+from streams.sim import write_vcd
+from streams.profiler import Profiler
+from streams import dot
+
+#
+#   A pipeline of full rate stages, with one slow stage in the middle
+
+class Pipeline(Elaboratable):
+
+    def __init__(self, layout):
+        self.name = "Pipeline"
+        self.i = Stream(layout=layout, name="i")
+        self.o = Stream(layout=layout, name="o")
+        self.a = Copy(layout, mode="skid")
+        self.b = Copy(layout, mode="skid")
+        self.slow = Copy(layout)
+        self.c = Copy(layout, mode="skid")
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += [ self.a, self.b, self.slow, self.c, ]
+
+        m.d.comb += Stream.connect(self.i, self.a.i)
+        m.d.comb += Stream.connect(self.a.o, self.b.i)
+        m.d.comb += Stream.connect(self.b.o, self.slow.i)
+        m.d.comb += Stream.connect(self.slow.o, self.c.i)
+        m.d.comb += Stream.connect(self.c.o, self.o)
+
+        return m
+
+#
+#
+
+def sim_profile(m, verbose):
+    print("test profile")
+    n = len(Stream.connections)
+    # record this design's connections in their own registry
+    with Connections() as c:
+        sim = Simulator(m)
+    assert len(Stream.connections) == n
+    assert len(c) == 11, len(c)
+    assert [ s for s, *_ in c.to_sink(m.slow.i) ] == [ m.b.o ]
+    prof = Profiler(m, connections=c)
+
+    def proc():
+        yield m.o.ready.eq(1)
+        yield m.i.valid.eq(1)
+        for i in range(300):
+            yield Tick()
+
+    sim.add_clock(1 / 100e6)
+    sim.add_testbench(proc)
+    sim.add_testbench(prof.run, background=True)
+    with write_vcd(sim, "gtk/profile.vcd", traces=[]):
+        sim.run()
+
+    if verbose:
+        prof.print_report()
+
+    r = dict([ (d["sink"], d) for d in prof.report() ])
+    # the connections inside the skid Copy blocks are found too
+    assert len(r) == 11, r.keys()
+    # the slow stage holds off everything before it, and starves what follows
+    d = r["Pipeline.slow.in"]
+    assert 30 < d["util"] < 40, d
+    assert d["stall"] > 50, d
+    d = r["Pipeline.c.in"]
+    assert 30 < d["util"] < 40, d
+    assert d["stall"] < 1, d
+    assert prof.bottleneck() == "Pipeline.slow", prof.bottleneck()
+
+    # the annotated dot graph : edges coloured by utilisation
+    os.makedirs("gtk", exist_ok=True)
+    path = "gtk/profile.dot"
+    f = open(path, "w")
+    dot.get_clusters(m).print_dot(f, annotate=prof.annotate, connections=c)
+    f.close()
+    text = open(path).read()
+    assert text.count("penwidth=") >= 11, text
+
+#
+#   dot.graph() reads the registry, and the weak default registry
+#   doesn't keep a design's connections once the design is gone
+
+def check_registry(verbose):
+    print("test registry")
+    m = Pipeline([ ("data", 16) ])
+    with Connections() as c:
+        Fragment.get(m, None)
+        assert len(c) == 11, len(c)
+        os.makedirs("gtk", exist_ok=True)
+        dot.graph(m, "gtk/registry.dot", "gtk/registry.png")
+        assert len(c) == 11, len(c)
+    text = open("gtk/registry.dot").read()
+    assert text.count("->") >= 11, text
+
+    c = Connections(weak=True)
+    with c:
+        Fragment.get(m, None)
+    assert len(c) == 11, len(c)
+    assert [ s for s, *_ in c.to_sink(m.slow.i) ] == [ m.b.o ]
+    del m
+    gc.collect()
+    assert len(c) == 0, len(c)
+    assert not (c.sources or c.sinks), (c.sources, c.sinks)
+
+#
+#
+
+def test(verbose):
+    dut = Pipeline([ ("data", 16) ])
+    sim_profile(dut, verbose)
+    check_registry(verbose)
+
+#
+#
+
+if __name__ == "__main__":
+    test(True)
+
+#   FIN
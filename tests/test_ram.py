@@ -9,7 +9,7 @@ if not spath in sys.path:
     sys.path.append(spath)
 
 from streams.stream import Stream 
-from streams.sim import SourceSim, SinkSim
+from streams.sim import SourceSim, SinkSim, write_vcd
 from streams.ram import StreamToRam, RamToStream, RamReader, DualPortMemory, WriteRam
 
 #
@@ -72,7 +72,7 @@ def sim_s2ram(verbose):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/s2ram.vcd", traces=[]):
+    with write_vcd(sim, "gtk/s2ram.vcd", traces=[]):
         sim.run()
 
 #
@@ -153,7 +153,7 @@ def sim_ram2s(verbose):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/ram2s.vcd", traces=[]):
+    with write_vcd(sim, "gtk/ram2s.vcd", traces=[]):
         sim.run()
 
 #
@@ -205,7 +205,7 @@ def sim_ramreader(verbose):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/ramread.vcd", traces=[]):
+    with write_vcd(sim, "gtk/ramread.vcd", traces=[]):
         sim.run()
 
 #
@@ -280,7 +280,7 @@ def sim_writeram(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/writeram.vcd", traces=[]):
+    with write_vcd(sim, "gtk/writeram.vcd", traces=[]):
         sim.run()
 
 #
@@ -10,7 +10,7 @@ sys.path.append(".")
 sys.path.append("streams/streams")
 
 from streams.stream import Stream, to_packet
-from streams.sim import SinkSim, SourceSim
+from streams.sim import SinkSim, SourceSim, write_vcd
 
 from streams.route import Head, Router, StreamSync, Packetiser, Event, Sequencer
 from streams.route import Select, Collator, MuxDown, MuxUp, PacketSplit
@@ -98,7 +98,7 @@ def sim_head(m, n):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/head.vcd", traces=[]):
+    with write_vcd(sim, "gtk/head.vcd", traces=[]):
         sim.run()
 
 #
@@ -161,7 +161,7 @@ def sim_router(m, addrs):
             
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/router.vcd", traces=[]):
+    with write_vcd(sim, "gtk/router.vcd", traces=[]):
         sim.run()
 
 #
@@ -211,7 +211,7 @@ def sim_sync(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/sync.vcd", traces=[]):
+    with write_vcd(sim, "gtk/sync.vcd", traces=[]):
         sim.run()
 
 #
@@ -283,7 +283,7 @@ def sim_packetiser(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/packetise.vcd", traces=[]):
+    with write_vcd(sim, "gtk/packetise.vcd", traces=[]):
         sim.run()
 
 #
@@ -370,7 +370,7 @@ def sim_event(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/event.vcd", traces=[]):
+    with write_vcd(sim, "gtk/event.vcd", traces=[]):
         sim.run()
 
 #
@@ -435,7 +435,7 @@ def sim_seq(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/seq.vcd", traces=[]):
+    with write_vcd(sim, "gtk/seq.vcd", traces=[]):
         sim.run()
 
 #
@@ -523,7 +523,7 @@ def sim_select(m, with_sink, ignore_packets=False):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/select.vcd", traces=[]):
+    with write_vcd(sim, "gtk/select.vcd", traces=[]):
         sim.run()
 
 #
@@ -606,7 +606,7 @@ def sim_collator(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/collator.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/collator.vcd", traces=[]):
         sim.run()
 
 #
@@ -679,7 +679,7 @@ def sim_collator_slow(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/collator.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/collator.vcd", traces=[]):
         sim.run()
 
 #
@@ -757,7 +757,7 @@ def sim_mux(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/mux.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/mux.vcd", traces=[]):
         sim.run()
 
 #
@@ -837,7 +837,7 @@ def sim_spi(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/spimux.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/spimux.vcd", traces=[]):
         sim.run()
 
 #
@@ -902,7 +902,7 @@ def sim_muxup(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/muxup.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/muxup.vcd", traces=[]):
         sim.run()
 
 #
@@ -973,7 +973,7 @@ def sim_packetsplit(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/packetsplit.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/packetsplit.vcd", traces=[]):
         sim.run()
 
 #
@@ -9,7 +9,7 @@ sys.path.append(".")
 sys.path.append("../streams")
 
 from streams import Stream
-from streams.sim import SinkSim, SourceSim
+from streams.sim import SinkSim, SourceSim, write_vcd
 
 from streams.sk9822 import Tx, SK9822
 
@@ -93,7 +93,7 @@ def sim_tx(m):
 
     sim.add_clock(12e-6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/tx_led.vcd"):
+    with write_vcd(sim, "gtk/tx_led.vcd"):
         sim.run()
 
 #
@@ -141,7 +141,7 @@ def sim_sk9822(m):
 
     sim.add_clock(12e-6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/sk9822.vcd"):
+    with write_vcd(sim, "gtk/sk9822.vcd"):
         sim.run()
 
 #
@@ -11,7 +11,7 @@ sys.path.append(".")
 sys.path.append("streams/streams")
 
 from streams.stream import Stream
-from streams.sim import SinkSim, SourceSim
+from streams.sim import SinkSim, SourceSim, write_vcd
 
 from streams.spdif import PREAMBLE, SPDIF_Rx, SPDIF_Tx,  SubframeReader, BlockReader, BitsReader, SubframeWriter
 
@@ -108,7 +108,7 @@ def sim_subframe(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/spdif.vcd", traces=[]):
+    with write_vcd(sim, "gtk/spdif.vcd", traces=[]):
         sim.run()
 
 #
@@ -173,7 +173,7 @@ def sim_block(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/spdif_block.vcd", traces=[]):
+    with write_vcd(sim, "gtk/spdif_block.vcd", traces=[]):
         sim.run()
 
 #
@@ -240,7 +240,7 @@ def sim_bits(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/spdif_bits.vcd", traces=[]):
+    with write_vcd(sim, "gtk/spdif_bits.vcd", traces=[]):
         sim.run()
 
 #
@@ -272,7 +272,7 @@ def sim_spdif(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/spdif_rx.vcd", traces=[]):
+    with write_vcd(sim, "gtk/spdif_rx.vcd", traces=[]):
         sim.run()
 
 #
@@ -372,7 +372,7 @@ def sim_decode(m, mout, gtk):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd(gtk, traces=[]):
+    with write_vcd(sim, gtk, traces=[]):
         sim.run()
 
 #
@@ -429,7 +429,7 @@ def sim_writer(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/spdif_wr.vcd", traces=[]):
+    with write_vcd(sim, "gtk/spdif_wr.vcd", traces=[]):
         sim.run()
 
 #
@@ -531,7 +531,7 @@ def sim_sf(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/spdif_sf.vcd", traces=[]):
+    with write_vcd(sim, "gtk/spdif_sf.vcd", traces=[]):
         sim.run()
 
 class SubframeTest(Elaboratable):
@@ -595,7 +595,7 @@ def sim_tx(m):
 
     sim.add_clock(1 / 50e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/spdif_tx.vcd", traces=[]):
+    with write_vcd(sim, "gtk/spdif_tx.vcd", traces=[]):
         sim.run()
 
 #
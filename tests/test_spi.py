@@ -10,7 +10,7 @@ if not spath in sys.path:
 
 from streams import to_packet
 from streams.spi import SpiController, SpiPeripheral, SpiClock
-from streams.sim import SinkSim, SourceSim
+from streams.sim import SinkSim, SourceSim, write_vcd
 
 #
 #
@@ -66,7 +66,7 @@ def sim_controller(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/spix.vcd", traces=m.ports()):
+    with write_vcd(sim, "gtk/spix.vcd", traces=m.ports()):
         sim.run()
 
 #
@@ -130,7 +130,7 @@ def sim_flags(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/spi_flags.vcd", traces=m.ports()):
+    with write_vcd(sim, "gtk/spi_flags.vcd", traces=m.ports()):
         sim.run()
 
 #
@@ -223,7 +223,7 @@ def sim_peripheral(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/spi_perihperal.vcd", traces=m.ports()):
+    with write_vcd(sim, "gtk/spi_perihperal.vcd", traces=m.ports()):
         sim.run()
 
 #
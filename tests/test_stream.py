@@ -9,7 +9,9 @@ if not spath in sys.path:
     sys.path.append(spath)
 
 from streams.stream import to_packet, StreamInit, StreamNull, Tee, Join, Split, GatePacket, Arbiter
-from streams.sim import SourceSim, SinkSim
+from streams.stream import Copy, Gate, Stream, StreamLayout
+from streams.sim import SourceSim, SinkSim, MonitorSim, BulkSourceSim, BulkSinkSim, write_vcd, sim_rate, sim_rate_ports
+from streams.sim import AsyncSourceSim, AsyncSinkSim, AsyncMonitorSim, NumpyCapture, Pattern
 
 #
 #
@@ -20,6 +22,44 @@ def get_field(name, data):
 def get_data(data):
     return [ d for _, d in data ]
 
+#
+#   Stream / StreamLayout : shared immutable layouts, slotted streams
+
+def check_layout(verbose):
+    print("test layout")
+    a = Stream([ ("x", 8), ("y", 4), ], name="a")
+    b = Stream([ ("x", 8), ("y", 4), ], name="b")
+    c = Stream(a.layout, name="c")
+
+    # equal layouts share one StreamLayout, which is hashable
+    assert a.layout is b.layout is c.layout
+    assert len(set([ a.layout, b.layout, StreamLayout.get([ ("x", 8), ]) ])) == 2
+    assert a.layout.width == 12
+    assert list(a.layout) == [ ("x", 8), ("y", 4), ]
+    try:
+        a.layout.width = 1
+        assert False, "layout is mutable"
+    except AttributeError:
+        pass
+
+    # the accessors don't copy, get_layout() still does
+    assert a.fields() is a.fields()
+    assert a.fields(flags=True)[-2:] == (("first", 1), ("last", 1))
+    assert a.signals() == (a.x, a.y)
+    x = a.get_layout()
+    x.append(("z", 1))
+    assert a.get_layout() == [ ("x", 8), ("y", 4), ]
+
+    # payload fields are still attributes, but nothing else can be added
+    assert a.x.width == 8
+    assert hasattr(a, "y") and not hasattr(a, "z")
+    assert "x" in dir(a)
+    try:
+        a.z = 1
+        assert False, "added an attribute"
+    except AttributeError:
+        pass
+
 #
 #
 
@@ -67,7 +107,7 @@ def sim_init(m, init_data, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/stream_init.vcd", traces=m.ports()):
+    with write_vcd(sim, "gtk/stream_init.vcd", traces=m.ports()):
         sim.run()
 
 #
@@ -106,7 +146,7 @@ def sim_null(m, n, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/stream_null.vcd", traces=m.ports()):
+    with write_vcd(sim, "gtk/stream_null.vcd", traces=m.ports()):
         sim.run()
 
 #
@@ -160,7 +200,7 @@ def sim_tee(m, verbose):
 
         for i, sink in enumerate(sinks):
             p = sink.get_data("data")
-            if m.wait_all or (i != 1):
+            if m.wait_all or m.depth or (i != 1):
                 assert p == tx_p, (i, p, tx_p)
             else:
                 assert p != tx_p, (i, p, tx_p)
@@ -168,7 +208,7 @@ def sim_tee(m, verbose):
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
     wait = m.wait_all
-    with sim.write_vcd(f"gtk/stream_tee_{wait}.vcd", traces=m.ports()):
+    with write_vcd(sim, f"gtk/stream_tee_{wait}.vcd", traces=m.ports()):
         sim.run()
 
 #
@@ -228,9 +268,37 @@ def sim_join(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/stream_join.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/stream_join.vcd", traces=[]):
         sim.run()
 
+#
+#   Join in pipe mode : one joined word per clock
+
+def sim_join_rate(m, verbose, stall=7):
+    print("test join rate")
+    n = 60
+
+    words = [
+        [ { "a" : i } for i in range(n) ],
+        [ { "b" : i + 100 } for i in range(n) ],
+    ]
+    # 'b' has a gap every 11 clocks
+    valid = lambda t, idx: (idx == 0) or ((t % 11) != 10)
+    ready = lambda t, idx: (t % stall) != (stall - 1)
+    rx, t, accepts = sim_rate_ports(m, [ m.a, m.b ], [ m.o ], words, valid=valid, ready=ready,
+                                    packet=True, vcd="gtk/stream_join_rate.vcd")
+
+    if verbose:
+        print("join rate", n, "words in", t, "clocks")
+    # the inputs are taken together
+    assert accepts[0] == accepts[1], accepts
+    assert [ (d["a"], d["b"]) for d in rx[0] ] == [ (i, i + 100) for i in range(n) ], rx
+    for i, d in enumerate(rx[0]):
+        assert d["first"] == (i == 0), (i, d)
+        assert d["last"] == (i == (n - 1)), (i, d)
+    # allow for the output stalls, the input gaps and the latency
+    assert t <= (n + (t // stall) + (t // 11) + 3), t
+
 #
 #
 
@@ -281,13 +349,39 @@ def sim_split(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/stream_join.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/stream_join.vcd", traces=[]):
         sim.run()
 
+#
+#   Split with depth : input runs at one word per clock,
+#   while one output stalls for a burst shorter than the fifo
+#   and the other is always ready.
+
+def sim_split_rate(m, verbose, stall=2):
+    print("test split rate")
+    n = 60
+
+    words = [ [ { "a" : i, "b" : i + 100 } for i in range(n) ] ]
+    # 'b' stalls for 'stall' clocks
+    ready = lambda t, idx: (idx == 0) or not (10 <= t < (10 + stall))
+    rx, t, accepts = sim_rate_ports(m, [ m.i ], [ m.a, m.b ], words, ready=ready,
+                                    packet=True, vcd="gtk/stream_split_rate.vcd")
+
+    if verbose:
+        print("split rate", n, "words in", t, "clocks")
+    # the input never waits while 'b' has fifo space
+    assert accepts[0] == list(range(n)), accepts[0]
+    for field, x, offset in [ ("a", rx[0], 0), ("b", rx[1], 100) ]:
+        assert [ d[field] for d in x ] == [ i + offset for i in range(n) ], (field, x)
+        for i, d in enumerate(x):
+            assert d["first"] == (i == 0), (field, i)
+            assert d["last"] == (i == (n - 1)), (field, i)
+    assert t <= (n + stall + 3), t
+
 #
 #
 
-def sim_gate(m, verbose):
+def sim_gate(m, verbose, margin=3):
     print("test gate")
     sim = Simulator(m)
 
@@ -343,7 +437,7 @@ def sim_gate(m, verbose):
 
         def check(idx, t, d):
             #print(idx, t, d, data[idx], enables)
-            margin = 3 # takes 3 clocks to travel src->sink
+            # margin : clocks to travel src->sink
             if idx in [ 0, 1, 4 ]:
                 assert t == (enables[idx] + margin)
                 assert d == data[idx][1]
@@ -362,7 +456,7 @@ def sim_gate(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/stream_gate.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/stream_gate.vcd", traces=[]):
         sim.run()
 
 #
@@ -445,9 +539,308 @@ def sim_arbiter(m, verbose):
 
     sim.add_clock(1 / 100e6)
     sim.add_process(proc)
-    with sim.write_vcd(f"gtk/stream_arb.vcd", traces=[]):
+    with write_vcd(sim, f"gtk/stream_arb.vcd", traces=[]):
+        sim.run()
+
+#
+#   sim_rate() drives the handshake directly (SourceSim/SinkSim are half rate)
+#   : check that one word per clock gets through.
+
+def check_rate(m, verbose, en=None, stall=7):
+    print("test rate", m.__class__.__name__)
+    data = list(range(1, 50))
+    if m.i.data.shape().signed:
+        data = [ x - 25 for x in data ]
+
+    setup = [] if en is None else [ en.eq(1) ]
+    words = [ { "data" : x } for x in data ]
+    rx, t = sim_rate(m, words, stall=stall, setup=setup, packet=True, vcd="gtk/stream_rate.vcd")
+
+    if verbose:
+        print("rate", len(data), "words in", t, "clocks")
+    assert [ d["data"] for d in rx ] == data, (rx, data)
+    for i, d in enumerate(rx):
+        assert d["first"] == (i == 0), (i, rx)
+        assert d["last"] == (i == (len(data) - 1)), (i, rx)
+    # allow for the output stalls plus a couple of clocks latency
+    stalls = (t + stall - 1) // stall
+    assert t <= (len(data) + stalls + 2), t
+
+#
+#   Bulk sim drivers : one word per clock through a skid buffer
+
+def sim_bulk(m, verbose):
+    print("test bulk sim", m.__class__.__name__)
+    sim = Simulator(m)
+
+    packets = [
+        [ { "data" : 1, "addr" : 2 }, { "data" : 3, "addr" : 4 }, ],
+        [ { "data" : 0xffff, "addr" : 0xf }, ],
+        [ { "data" : x, "addr" : x & 0xf } for x in range(100, 140) ],
+    ]
+    ints = [ 7, 8, 9 ]
+    if m.i.data.shape().signed:
+        # read back sign extended
+        packets[1][0]["data"] = -1
+        packets[2] = [ { "data" : x - 120, "addr" : x & 0xf } for x in range(100, 140) ]
+        ints = [ 7, -8, 9 ]
+    n = sum([ len(p) for p in packets ])
+
+    src = BulkSourceSim(m.i, packets, verbose=verbose)
+    sink = BulkSinkSim(m.o)
+
+    def proc():
+        t = 0
+        while not src.done():
+            yield Tick()
+            yield from src.poll()
+            yield from sink.poll()
+            t += 1
+        for i in range(5):
+            yield Tick()
+            yield from src.poll()
+            yield from sink.poll()
+
+        if verbose:
+            print("bulk", n, "words in", t, "clocks")
+        assert t <= (n + 3), t
+        rx = sink.get_data()
+        assert [ len(p) for p in rx ] == [ len(p) for p in packets ], rx
+        for p, q in zip(rx, packets):
+            for i, (d, e) in enumerate(zip(p, q)):
+                assert (d["data"], d["addr"]) == (e["data"], e["addr"]), (d, e)
+                assert d["first"] == (i == 0)
+                assert d["last"] == (i == (len(q) - 1))
+
+        # ints for the 'data' field
+        src.push_packets([ ints ])
+        for i in range(10):
+            yield Tick()
+            yield from src.poll()
+            yield from sink.poll()
+        assert sink.get_data("data")[-1] == ints, sink.get_data("data")
+
+    sim.add_clock(1 / 100e6)
+    sim.add_process(proc)
+    with write_vcd(sim, f"gtk/stream_bulk.vcd", traces=[]):
+        sim.run()
+
+#
+#   async testbench sim classes : a fast and a slow sink on a Tee
+
+def sim_async_tb(m, verbose):
+    print("test async sim", m.__class__.__name__)
+    sim = Simulator(m)
+
+    packets = [
+        [ 1, 2, 3, 4, ],
+        [ 100, ],
+        list(range(200, 230)),
+    ]
+    if m.i.data.shape().signed:
+        packets = [ [ 1, -2, 3, -4, ], [ -100, ], list(range(-15, 15)), ]
+    src = AsyncSourceSim(m.i, packets, verbose=verbose)
+    mon = AsyncMonitorSim(m.i)
+    fast = AsyncSinkSim(m.o[0])
+    slow = AsyncSinkSim(m.o[1], slow=2)
+
+    async def bench(ctx):
+        await src.run(ctx)
+        assert src.done()
+        # let the slow sink drain
+        await ctx.tick().repeat(150)
+        for s in [ mon, fast, slow ]:
+            assert s.get_data("data") == packets, (s.name, s.get_data("data"))
+        d = fast.get_data()
+        assert [ x["first"] for x in d[0] ] == [ 1, 0, 0, 0 ], d[0]
+        assert [ x["last"] for x in d[0] ] == [ 0, 0, 0, 1 ], d[0]
+
+    sim.add_clock(1 / 100e6)
+    sim.add_testbench(bench)
+    for s in [ mon, fast, slow ]:
+        sim.add_testbench(s.run, background=True)
+    with write_vcd(sim, f"gtk/stream_async.vcd", traces=[]):
+        sim.run()
+
+#
+#   MonitorSim / SinkSim with capture="numpy"
+
+def sim_numpy(m, verbose):
+    print("test numpy capture", m.__class__.__name__)
+    sim = Simulator(m)
+
+    src = SourceSim(m.i, verbose=verbose)
+    mon = MonitorSim(m.i, capture="numpy")
+    sink = SinkSim(m.o, capture="numpy")
+    # the dict capture, to compare with
+    ref = MonitorSim(m.o)
+
+    packets = [
+        [ 1, 2, 3, 4, ],
+        [ 100, ],
+        list(range(200, 230)),
+    ]
+    if m.i.data.shape().signed:
+        packets = [ [ 1, -2, 3, -4, ], [ -100, ], list(range(-15, 15)), ]
+    for p in packets:
+        for x in to_packet(p):
+            src.push(0, **x)
+
+    def proc():
+        for i in range(150):
+            yield Tick()
+            yield from src.poll()
+            yield from mon.poll()
+            yield from ref.poll()
+            yield from sink.poll()
+
+        assert [ list(p) for p in sink.get_data("data") ] == ref.get_data("data")
+        for s in [ mon, sink ]:
+            d = s.get_data("data")
+            assert [ list(p) for p in d ] == packets, d
+            a = s.get_array()
+            assert list(a["data"]) == sum(packets, []), a
+            assert list(a["_p"]) == sum([ [ i ] * len(p) for i, p in enumerate(packets) ], [])
+            assert a["first"].sum() == len(packets)
+            assert a["last"].sum() == len(packets)
+        # the output is later than the input
+        assert (sink.get_array("_t") > mon.get_array("_t")).all()
+
+    sim.add_clock(1 / 100e6)
+    sim.add_process(proc)
+    with write_vcd(sim, f"gtk/stream_numpy.vcd", traces=[]):
         sim.run()
 
+    # check the capture grows
+    layout = [ ("data", 16), ("first", 1), ("last", 1) ]
+    c = NumpyCapture(layout, size=4)
+    for i in range(1000):
+        c.append(i, (i % 10) == 0, (i & 0xffff) | ((i % 10 == 0) << 16))
+    assert list(c.get_array("data")) == list(range(1000))
+    d = c.get_data("data")
+    assert len(d) == 100
+    assert list(d[-1]) == list(range(990, 1000))
+    assert c.get_array("first").sum() == 100
+
+#
+#   Random valid / ready patterns, with handshake stats
+
+def sim_pattern(m, src_pattern, sink_pattern, verbose):
+    print("test pattern", src_pattern.kind, sink_pattern.kind)
+    sim = Simulator(m)
+
+    src = SourceSim(m.i, verbose=verbose, pattern=src_pattern)
+    sink = SinkSim(m.o, pattern=sink_pattern)
+
+    packets = [ list(range(i * 10, (i * 10) + 1 + (i % 7))) for i in range(30) ]
+    for p in packets:
+        for x in to_packet(p):
+            src.push(0, **x)
+    n = sum([ len(p) for p in packets ])
+
+    def proc():
+        t = 0
+        while (sink.get_stats()["transfers"] < n) and (t < 2000):
+            yield Tick()
+            yield from src.poll()
+            yield from sink.poll()
+            t += 1
+
+        assert sink.get_data("data") == packets, sink.get_data("data")
+        s = src.get_stats()
+        k = sink.get_stats()
+        if verbose:
+            print("src", s)
+            print("sink", k)
+        assert s["transfers"] == n, s
+        assert k["transfers"] == n, k
+        assert k["throughput"] <= min(src_pattern.p, sink_pattern.p) + 0.1, k
+        if sink_pattern.p < 1:
+            assert k["stalls"] > 0, k
+        return s, k
+
+    sim.add_clock(1 / 100e6)
+    sim.add_process(proc)
+    with write_vcd(sim, f"gtk/stream_pattern.vcd", traces=[]):
+        sim.run()
+
+def sim_patterns(verbose):
+    layout = [ ( "data", 16 ), ]
+    for src, sink in [
+            (Pattern("bernoulli", p=0.7, seed=1), Pattern("bernoulli", p=0.6, seed=2)),
+            (Pattern("bernoulli", p=1.0), Pattern("bursty", p=0.5, burst=6, seed=3)),
+            (Pattern("periodic", p=1.0, period=1), Pattern("periodic", p=0.5, period=4)),
+            (Pattern("bernoulli", p=1.0), Pattern("bernoulli", p=1.0)),
+        ]:
+        dut = Copy(layout, mode="skid")
+        sim_pattern(dut, src, sink, verbose)
+
+    # the patterns give the requested duty
+    for kind in Pattern.kinds:
+        pat = Pattern(kind, p=0.25, burst=5, period=8, seed=4)
+        on = sum([ pat.next() for i in range(20000) ])
+        assert abs((on / 20000) - 0.25) < 0.02, (kind, on)
+
+#
+#   Tee with fifos : broadcast at one word per clock
+
+def sim_tee_rate(m, verbose):
+    print("test rate Tee", m.depth)
+    data = list(range(1, 50))
+
+    words = [ [ { "data" : x } for x in data ] ]
+    # output 1 has a burst of stalls
+    ready = lambda t, idx: (idx != 1) or not (10 <= t < 13)
+    rx, t, accepts = sim_rate_ports(m, [ m.i ], m.o, words, ready=ready, vcd="gtk/stream_tee_rate.vcd")
+
+    if verbose:
+        print("rate", len(data), "words in", t, "clocks")
+    for x in rx:
+        assert [ d["data"] for d in x ] == data, (x, data)
+    # the output stalls are absorbed by the fifos : input never stalls
+    assert accepts[0][-1] == (len(data) - 1), accepts[0]
+    assert t <= (len(data) + 3 + 2), t
+
+#
+#   All inputs busy : check the share each input gets,
+#   and that the output moves one word per clock.
+
+def sim_arbiter_rate(m, verbose, psize=1):
+    print("test rate Arbiter", m.policy, m.weights)
+    n = len(m.i)
+
+    # more words than the inputs can send : they are always busy
+    words = []
+    for k in range(n):
+        words.append([ {
+            "data" : (k << 8) + (seq // psize),
+            "first" : (seq % psize) == 0,
+            "last" : (seq % psize) == (psize - 1),
+        } for seq in range(200) ])
+    rx, t, _ = sim_rate_ports(m, m.i, [ m.o ], words, count=None, limit=200, vcd="gtk/stream_arb_rate.vcd")
+    rx = [ d["data"] for d in rx[0] ]
+
+    # once started, the output is busy every clock
+    assert len(rx) >= (t - 3), (len(rx), t)
+
+    # each input's packets arrive in order
+    for k in range(n):
+        p = [ (d & 0xff) for d in rx if (d >> 8) == k ]
+        assert p == sorted(p), (k, p)
+
+    # share of the output for each input, in packets
+    counts = [ len([ d for d in rx if (d >> 8) == k ]) for k in range(n) ]
+    total = sum(m.weights)
+    for k, c in enumerate(counts):
+        expect = (len(rx) * m.weights[k]) / total
+        assert abs(c - expect) <= (2 * psize * max(m.weights)), (counts, m.weights)
+
+    # round robin : whole packets from each input, in turn
+    if m.policy == "round_robin":
+        chans = [ (d >> 8) for d in rx[::psize] ]
+        for i, c in enumerate(chans):
+            assert c == (i % n), chans
+
 #
 #
 
@@ -459,6 +852,9 @@ def test(verbose=False):
 
     layout = [ ( "data", 16 ), ]
 
+    if (name == "Stream") or test_all:
+        check_layout(verbose)
+
     if (name == "StreamInit") or test_all:
         data = to_packet([ 0xabcd, 0xffff, 0xaaaa, 0x0000, 0x5555 ])
         dut = StreamInit(data, layout)
@@ -473,22 +869,74 @@ def test(verbose=False):
         sim_tee(dut, verbose)
         dut = Tee(3, layout, wait_all=True)
         sim_tee(dut, verbose)
+        dut = Tee(3, layout, depth=4)
+        sim_tee(dut, verbose)
+        dut = Tee(3, layout, depth=8)
+        sim_tee_rate(dut, verbose)
+        dut = Tee(2, layout, depth=4)
+        sim_async_tb(dut, verbose)
+        dut = Tee(2, [ ("data", signed(16)) ], depth=4)
+        sim_async_tb(dut, verbose)
 
     if (name == "Join") or test_all:
         dut = Join(a=[("a", 8)], b=[("b", 8)])
         sim_join(dut, verbose)
+        dut = Join(a=[("a", 8)], b=[("b", 8)], mode="pipe")
+        sim_join(dut, verbose)
+        dut = Join(a=[("a", 8)], b=[("b", 8)], mode="pipe")
+        sim_join_rate(dut, verbose)
 
     if (name == "Split") or test_all:
         dut = Split(layout=[("a", 12), ("b", 8), ("c", 8)])
         sim_split(dut, verbose)
+        dut = Split(layout=[("a", 12), ("b", 8), ("c", 8)], depth=2)
+        sim_split(dut, verbose)
+        dut = Split(layout=[("a", 8), ("b", 8)], depth=4)
+        sim_split_rate(dut, verbose)
 
     if (name == "GatePacket") or test_all:
         dut = GatePacket(layout=[("data", 16)])
         sim_gate(dut, verbose)
+        dut = GatePacket(layout=[("data", 16)], registered=False)
+        sim_gate(dut, verbose, margin=1)
 
     if (name == "Arbiter") or test_all:
         dut = Arbiter(layout=[("data", 16)], n=3)
         sim_arbiter(dut, verbose)
+        for policy, weights in [ ("round_robin", None), ("weighted", [ 1, 3, 2 ]) ]:
+            dut = Arbiter(layout=[("data", 16)], n=3, policy=policy, weights=weights)
+            sim_arbiter(dut, verbose)
+        dut = Arbiter(layout=[("data", 16)], n=4, policy="round_robin")
+        sim_arbiter_rate(dut, verbose)
+        dut = Arbiter(layout=[("data", 16)], n=4, policy="round_robin")
+        sim_arbiter_rate(dut, verbose, psize=3)
+        dut = Arbiter(layout=[("data", 16)], n=4, policy="weighted", weights=[ 1, 2, 1, 4 ])
+        sim_arbiter_rate(dut, verbose)
+        dut = Arbiter(layout=[("data", 16)], n=17, policy="round_robin")
+        sim_arbiter_rate(dut, verbose)
+        dut = Arbiter(layout=[("data", signed(12))], n=2, policy="round_robin")
+        sim_arbiter_rate(dut, verbose)
+
+    if (name == "Copy") or test_all:
+        dut = Copy(layout, mode="skid")
+        check_rate(dut, verbose)
+        dut = Copy([ ("data", signed(12)) ], mode="skid")
+        check_rate(dut, verbose)
+        dut = Copy([ ("data", 16), ("addr", 4) ], mode="skid")
+        sim_bulk(dut, verbose)
+        dut = Copy([ ("data", signed(16)), ("addr", 4) ], mode="skid")
+        sim_bulk(dut, verbose)
+        dut = Copy(layout)
+        sim_numpy(dut, verbose)
+        dut = Copy([ ("data", signed(16)) ])
+        sim_numpy(dut, verbose)
+        sim_patterns(verbose)
+
+    if (name == "Gate") or test_all:
+        dut = Gate(layout, mode="skid")
+        check_rate(dut, verbose, en=dut.en)
+        dut = Gate(layout, registered=False)
+        check_rate(dut, verbose, en=dut.en)
 
 #
 #
@@ -9,7 +9,7 @@ sys.path.append(".")
 sys.path.append("../streams")
 
 from streams import Stream
-from streams.sim import SinkSim, SourceSim
+from streams.sim import SinkSim, SourceSim, write_vcd
 
 from streams.uart import UART_Tx
 
@@ -71,7 +71,7 @@ def sim_uarttx(m, mod):
 
     sim.add_clock(12e-6)
     sim.add_process(proc)
-    with sim.write_vcd("gtk/uarttx.vcd"):
+    with write_vcd(sim, "gtk/uarttx.vcd"):
         sim.run()
 
 #
@@ -9,7 +9,7 @@ if not spath in sys.path:
 
 
 from streams.stream import Stream 
-from streams.sim import SinkSim, SourceSim
+from streams.sim import SinkSim, SourceSim, write_vcd
 
 from streams.ws2812 import LedStream
 
@@ -51,7 +51,7 @@ def sim_leds(m, verbose):
 
     sim.add_clock(1 / 50e6)
     sim.add_sync_process(proc)
-    with sim.write_vcd("gtk/ws2812.vcd", traces=[]):
+    with write_vcd(sim, "gtk/ws2812.vcd", traces=[]):
         sim.run()
 
 #